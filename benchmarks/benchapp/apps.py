@@ -0,0 +1,24 @@
+# Django
+from django.apps import AppConfig
+from django.db.models.signals import pre_migrate
+
+
+def create_collation(using, **kwargs):
+    """The user model's fields use a case insensitive collation, which must
+    exist before its table is created
+    """
+    # Django
+    from django.db import connections
+
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "CREATE COLLATION IF NOT EXISTS case_insensitive "
+            "(provider = icu, locale = 'und-u-ks-level2', deterministic = false)"
+        )
+
+
+class BenchappConfig(AppConfig):
+    name = "benchapp"
+
+    def ready(self):
+        pre_migrate.connect(create_collation, sender=self)
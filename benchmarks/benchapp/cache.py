@@ -0,0 +1,18 @@
+# Django
+from django.core.cache.backends.locmem import LocMemCache
+
+# Standard Library
+import threading
+
+
+class LockingLocMemCache(LocMemCache):
+    """A local memory cache with the `lock` method squarelet auth expects from
+    the shared cache, for single process benchmarks
+    """
+
+    _locks = {}
+    _locks_lock = threading.Lock()
+
+    def lock(self, key):
+        with self._locks_lock:
+            return self._locks.setdefault(key, threading.Lock())
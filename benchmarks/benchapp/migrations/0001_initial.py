@@ -0,0 +1,218 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:24
+
+import django.utils.timezone
+import squarelet_auth.fields
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="User",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("password", models.CharField(max_length=128, verbose_name="password")),
+                (
+                    "last_login",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="last login"
+                    ),
+                ),
+                (
+                    "is_superuser",
+                    models.BooleanField(
+                        default=False,
+                        help_text="Designates that this user has all permissions without explicitly assigning them.",
+                        verbose_name="superuser status",
+                    ),
+                ),
+                (
+                    "uuid",
+                    models.UUIDField(
+                        db_index=True,
+                        default=uuid.uuid4,
+                        editable=False,
+                        help_text="Unique ID to link users across MuckRock's sites",
+                        unique=True,
+                        verbose_name="UUID",
+                    ),
+                ),
+                (
+                    "name",
+                    models.CharField(
+                        help_text="The user's full name",
+                        max_length=255,
+                        verbose_name="full name",
+                    ),
+                ),
+                (
+                    "email",
+                    models.EmailField(
+                        db_collation="case_insensitive",
+                        help_text="The user's primary email address",
+                        max_length=254,
+                        null=True,
+                        unique=True,
+                        verbose_name="email",
+                    ),
+                ),
+                (
+                    "username",
+                    models.CharField(
+                        db_collation="case_insensitive",
+                        help_text="A unique public identifier for the user",
+                        max_length=150,
+                        unique=True,
+                        verbose_name="username",
+                    ),
+                ),
+                (
+                    "avatar_url",
+                    models.URLField(
+                        blank=True,
+                        help_text="A URL which points to an avatar for the user",
+                        max_length=255,
+                        verbose_name="avatar url",
+                    ),
+                ),
+                (
+                    "bio",
+                    models.TextField(
+                        blank=True,
+                        help_text="Public bio for the user, in Markdown",
+                        verbose_name="bio",
+                    ),
+                ),
+                (
+                    "is_staff",
+                    models.BooleanField(
+                        default=False,
+                        help_text="Designates whether the user can log into this admin site.",
+                        verbose_name="staff status",
+                    ),
+                ),
+                (
+                    "is_active",
+                    models.BooleanField(
+                        default=True,
+                        help_text="Designates whether this user should be treated as active. Unselect this instead of deleting accounts.",
+                        verbose_name="active",
+                    ),
+                ),
+                (
+                    "email_failed",
+                    models.BooleanField(
+                        default=False,
+                        help_text="Has an email we sent to this user's email address failed?",
+                        verbose_name="email failed",
+                    ),
+                ),
+                (
+                    "email_verified",
+                    models.BooleanField(
+                        default=False,
+                        help_text="Has this user's email address been verified?",
+                        verbose_name="email verified",
+                    ),
+                ),
+                (
+                    "created_at",
+                    squarelet_auth.fields.AutoCreatedField(
+                        default=django.utils.timezone.now,
+                        editable=False,
+                        help_text="Timestamp of when the user was created",
+                        verbose_name="created at",
+                    ),
+                ),
+                (
+                    "updated_at",
+                    squarelet_auth.fields.AutoLastModifiedField(
+                        default=django.utils.timezone.now,
+                        editable=False,
+                        help_text="Timestamp of when the user was last updated",
+                        verbose_name="updated at",
+                    ),
+                ),
+                (
+                    "squarelet_synced_at",
+                    models.DateTimeField(
+                        blank=True,
+                        editable=False,
+                        help_text="Timestamp of when changed data from squarelet was last applied",
+                        null=True,
+                        verbose_name="squarelet synced at",
+                    ),
+                ),
+                (
+                    "squarelet_hash",
+                    models.CharField(
+                        blank=True,
+                        editable=False,
+                        help_text="A hash of the data from squarelet which was last applied",
+                        max_length=64,
+                        verbose_name="squarelet hash",
+                    ),
+                ),
+                (
+                    "is_verified_journalist",
+                    models.BooleanField(
+                        default=None,
+                        editable=False,
+                        help_text="Is this user a member of a verified journalistic organization?  Kept in sync with their organizations, unknown until first synced",
+                        null=True,
+                        verbose_name="verified journalist",
+                    ),
+                ),
+                (
+                    "use_autologin",
+                    models.BooleanField(
+                        default=True,
+                        help_text="Links you receive in emails from us will contain a token to automatically log you in",
+                        verbose_name="use autologin",
+                    ),
+                ),
+                (
+                    "groups",
+                    models.ManyToManyField(
+                        blank=True,
+                        help_text="The groups this user belongs to. A user will get all permissions granted to each of their groups.",
+                        related_name="user_set",
+                        related_query_name="user",
+                        to="auth.group",
+                        verbose_name="groups",
+                    ),
+                ),
+                (
+                    "user_permissions",
+                    models.ManyToManyField(
+                        blank=True,
+                        help_text="Specific permissions for this user.",
+                        related_name="user_set",
+                        related_query_name="user",
+                        to="auth.permission",
+                        verbose_name="user permissions",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ("username",),
+                "abstract": False,
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:24
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("benchapp", "0001_initial"),
+        migrations.swappable_dependency(settings.SQUARELET_ORGANIZATION_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="active_organization",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                help_text="The organization of the user's active membership, kept in sync with the memberships to avoid a join",
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to=settings.SQUARELET_ORGANIZATION_MODEL,
+                verbose_name="active organization",
+            ),
+        ),
+    ]
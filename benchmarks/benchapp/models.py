@@ -0,0 +1,6 @@
+# SquareletAuth
+from squarelet_auth.users.models import User as AbstractUser
+
+
+class User(AbstractUser):
+    pass
@@ -0,0 +1,257 @@
+"""A local stand-in for squarelet, serving synthetic users and organizations
+
+Run it directly to serve on a port, or use `FakeSquarelet` to run it in a
+background thread:
+
+    python benchmarks/fake_squarelet.py --port 8001 --users 1000 --orgs-per-user 3
+"""
+
+# Standard Library
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+from uuid import UUID, uuid5
+
+NAMESPACE = UUID("7f7e4b52-3d9b-4b37-9a5f-8f3a1f6a2c11")
+
+
+class SyntheticData:
+    """Deterministic synthetic squarelet data
+
+    User `i` is a member of their individual organization, which shares
+    their UUID, and of `orgs_per_user` organizations from a shared pool
+    """
+
+    def __init__(self, users=1000, organizations=100, orgs_per_user=3):
+        self.users = users
+        self.organizations = max(organizations, orgs_per_user)
+        self.orgs_per_user = orgs_per_user
+        self.user_uuids = [str(uuid5(NAMESPACE, f"user-{i}")) for i in range(users)]
+        self.org_uuids = [
+            str(uuid5(NAMESPACE, f"org-{i}")) for i in range(self.organizations)
+        ]
+        self._user_index = {uuid: i for i, uuid in enumerate(self.user_uuids)}
+        self._org_index = {uuid: i for i, uuid in enumerate(self.org_uuids)}
+
+    def user(self, index):
+        uuid = self.user_uuids[index]
+        organizations = [self._individual_organization(index, admin=True)]
+        for offset in range(self.orgs_per_user):
+            org_index = (index + offset) % self.organizations
+            organizations.append(
+                dict(self._organization(org_index), admin=(index + offset) % 7 == 0)
+            )
+        return {
+            "uuid": uuid,
+            "preferred_username": f"user{index}",
+            "email": f"user{index}@example.com",
+            "name": f"User {index}",
+            "picture": "",
+            "email_failed": False,
+            "email_verified": True,
+            "use_autologin": True,
+            "bio": "",
+            "is_agency": False,
+            "organizations": organizations,
+        }
+
+    def organization(self, index):
+        return self._organization(index)
+
+    def user_by_uuid(self, uuid):
+        index = self._user_index.get(uuid)
+        return None if index is None else self.user(index)
+
+    def organization_by_uuid(self, uuid):
+        index = self._org_index.get(uuid)
+        if index is not None:
+            return self._organization(index)
+        index = self._user_index.get(uuid)
+        if index is not None:
+            return self._individual_organization(index)
+        return None
+
+    def _entitlements(self, slug):
+        return [
+            {
+                "name": slug.title(),
+                "slug": slug,
+                "description": f"The {slug} plan",
+                "resources": {"minutes": 100},
+                "update_on": "2026-01-01",
+            }
+        ]
+
+    def _organization(self, index):
+        return {
+            "uuid": self.org_uuids[index],
+            "name": f"Organization {index}",
+            "slug": f"organization-{index}",
+            "entitlements": self._entitlements("organization"),
+            "max_users": 50,
+            "individual": False,
+            "private": False,
+            "card": "",
+            "payment_failed": False,
+            "avatar_url": "",
+            "verified_journalist": index % 2 == 0,
+        }
+
+    def _individual_organization(self, index, **extra):
+        return dict(
+            {
+                "uuid": self.user_uuids[index],
+                "name": f"user{index}",
+                "slug": f"user{index}",
+                "entitlements": [],
+                "max_users": 1,
+                "individual": True,
+                "private": True,
+                "card": "",
+                "payment_failed": False,
+                "avatar_url": "",
+                "verified_journalist": False,
+            },
+            **extra,
+        )
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serve the subset of the squarelet API used by squarelet auth"""
+
+    # set on the server
+    data = None
+    latency = 0
+    page_size = 100
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self._sleep()
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        routes = [
+            (r"^/api/users/$", lambda: self._list("users", query)),
+            (r"^/api/organizations/$", lambda: self._list("organizations", query)),
+            (r"^/api/users/([^/]+)/$", self.data.user_by_uuid),
+            (r"^/api/organizations/([^/]+)/$", self.data.organization_by_uuid),
+            (r"^/openid/\.well-known/openid-configuration$", self._configuration),
+            (r"^/openid/jwks$", lambda: {"keys": []}),
+            (r"^/openid/userinfo$", self._userinfo),
+        ]
+        for pattern, view in routes:
+            match = re.match(pattern, url.path)
+            if match:
+                self._json(view(*match.groups()))
+                return
+        self._json(None)
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        self._sleep()
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        if self.path.startswith("/openid/token"):
+            self._json(
+                {
+                    "access_token": "fake-token",
+                    "token_type": "Bearer",
+                    "expires_in": 3600,
+                }
+            )
+        else:
+            self._json(None)
+
+    def _sleep(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _list(self, type_, query):
+        page_size = int(query.get("page_size", [self.page_size])[0])
+        offset = int(query.get("offset", [0])[0])
+        if type_ == "users":
+            total = self.data.users
+            item = self.data.user
+        else:
+            total = self.data.organizations
+            item = self.data.organization
+        results = [item(i) for i in range(offset, min(offset + page_size, total))]
+        next_url = None
+        if offset + page_size < total:
+            params = urlencode({"page_size": page_size, "offset": offset + page_size})
+            next_url = f"http://{self.headers['Host']}/api/{type_}/?{params}"
+        return {"count": total, "next": next_url, "results": results}
+
+    def _configuration(self):
+        base = f"http://{self.headers['Host']}/openid"
+        return {
+            "issuer": base,
+            "authorization_endpoint": f"{base}/authorize",
+            "token_endpoint": f"{base}/token",
+            "userinfo_endpoint": f"{base}/userinfo",
+            "jwks_uri": f"{base}/jwks",
+            "end_session_endpoint": f"{base}/end-session",
+        }
+
+    def _userinfo(self):
+        return self.data.user(0)
+
+    def _json(self, content):
+        if content is None:
+            self.send_response(404)
+            body = b'{"detail": "Not found."}'
+        else:
+            self.send_response(200)
+            body = json.dumps(content).encode("utf8")
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeSquarelet:
+    """Run the fake squarelet server in a background thread"""
+
+    def __init__(self, data, latency=0, port=0):
+        handler = type("BoundHandler", (Handler,), {"data": data, "latency": latency})
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--organizations", type=int, default=100)
+    parser.add_argument("--orgs-per-user", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0, help="In seconds")
+    args = parser.parse_args()
+
+    data = SyntheticData(args.users, args.organizations, args.orgs_per_user)
+    with FakeSquarelet(data, args.latency, args.port) as server:
+        print(f"Serving fake squarelet on {server.url}")
+        try:
+            server.thread.join()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+"""Benchmark the squarelet sync paths against a local fake squarelet
+
+Reports the wall time, queries and peak allocations per sync for pulling
+data, updating from a payload and the login pipeline, and the throughput
+from webhook to applied data.
+
+Requires a PostgreSQL server, the test database is created and destroyed
+by the run.  Connection details are read from the environment:
+BENCH_DB_NAME, BENCH_DB_USER, BENCH_DB_PASSWORD, BENCH_DB_HOST and
+BENCH_DB_PORT.
+
+    python benchmarks/run.py --users 200 --orgs-per-user 5 --latency 0.005
+
+Pass --baseline with the results of an earlier run saved with --json to fail
+when a benchmark has regressed.  Query counts may not increase at all, while
+timings, allocations and throughput may be up to --tolerance worse.  The
+timings in benchmarks/baseline.json were recorded with the command above, and
+are only meaningful on similar hardware, re-record them with --json to compare
+on another machine.
+"""
+
+# Standard Library
+import argparse
+import copy
+import hashlib
+import hmac
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from fake_squarelet import FakeSquarelet, SyntheticData  # isort:skip
+
+SECRET = "benchmark-secret"
+
+# the metrics compared with the baseline, and whether a higher value is worse
+METRICS = [
+    ("mean_ms", True),
+    ("p95_ms", True),
+    ("queries", True),
+    ("peak_kib", True),
+    ("per_second", False),
+]
+
+
+def configure(squarelet_url, args):
+    # Django
+    import django
+    from django.conf import settings
+
+    settings.configure(
+        DEBUG=False,
+        INSTALLED_APPS=(
+            "django.contrib.admin",
+            "django.contrib.contenttypes",
+            "django.contrib.auth",
+            "django.contrib.messages",
+            "django.contrib.sessions",
+            "squarelet_auth",
+            "squarelet_auth.organizations.apps.OrganizationsConfig",
+            "benchapp",
+        ),
+        DATABASES={
+            "default": {
+                "ENGINE": "django.db.backends.postgresql",
+                "NAME": os.environ.get("BENCH_DB_NAME", "squarelet_auth_bench"),
+                "USER": os.environ.get("BENCH_DB_USER", ""),
+                "PASSWORD": os.environ.get("BENCH_DB_PASSWORD", ""),
+                "HOST": os.environ.get("BENCH_DB_HOST", ""),
+                "PORT": os.environ.get("BENCH_DB_PORT", ""),
+            }
+        },
+        DEFAULT_AUTO_FIELD="django.db.models.AutoField",
+        CACHES={"default": {"BACKEND": "benchapp.cache.LockingLocMemCache"}},
+        AUTH_USER_MODEL="benchapp.User",
+        SOCIAL_AUTH_SQUARELET_KEY="benchmark",
+        SOCIAL_AUTH_SQUARELET_SECRET=SECRET,
+        SQUARELET_ORGANIZATION_MODEL="squarelet_auth_organizations.Organization",
+        SQUARELET_URL=squarelet_url,
+        SQUARELET_DISABLE_CREATE=False,
+        SQUARELET_WEBHOOK_DEBOUNCE=0,
+        SQUARELET_WEBHOOK_BATCH_SIZE=args.webhook_batch,
+        BASE_URL="http://localhost",
+        USE_TZ=True,
+    )
+    django.setup()
+
+    # Django
+    from celery import Celery
+
+    app = Celery("benchmarks")
+    app.conf.task_always_eager = True
+    app.conf.task_eager_propagates = True
+    app.set_current()
+
+
+def create_database():
+    # Django
+    from django.db import connection
+
+    return connection.creation.create_test_db(verbosity=0, serialize=False)
+
+
+def destroy_database(old_name):
+    # Django
+    from django.db import connection
+
+    connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+class Benchmark:
+    """Collect per call timings, query counts and allocations"""
+
+    def __init__(self, allocations):
+        self.allocations = allocations
+        self.results = []
+
+    def run(self, name, func, items):
+        # Django
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        times = []
+        queries = []
+        allocated = []
+        for item in items:
+            if self.allocations:
+                tracemalloc.reset_peak()
+                start_memory = tracemalloc.get_traced_memory()[0]
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                func(item)
+                times.append(time.perf_counter() - start)
+            queries.append(len(context))
+            if self.allocations:
+                allocated.append(tracemalloc.get_traced_memory()[1] - start_memory)
+
+        times.sort()
+        self.results.append(
+            {
+                "name": name,
+                "calls": len(times),
+                "mean_ms": statistics.mean(times) * 1000,
+                "p95_ms": times[int(len(times) * 0.95) - 1] * 1000,
+                "queries": statistics.mean(queries),
+                "peak_kib": statistics.mean(allocated) / 1024 if allocated else None,
+            }
+        )
+
+    def throughput(self, name, func, batches):
+        count = 0
+        start = time.perf_counter()
+        for batch in batches:
+            func(batch)
+            count += len(batch)
+        elapsed = time.perf_counter() - start
+        self.results.append(
+            {
+                "name": name,
+                "calls": count,
+                "total_s": elapsed,
+                "per_second": count / elapsed if elapsed else None,
+            }
+        )
+
+    def report(self):
+        print(
+            f"{'benchmark':<36}{'calls':>8}{'mean ms':>10}{'p95 ms':>10}"
+            f"{'queries':>10}{'peak KiB':>10}{'objects/s':>12}"
+        )
+        for result in self.results:
+            print(
+                f"{result['name']:<36}{result['calls']:>8}"
+                f"{_format(result.get('mean_ms')):>10}"
+                f"{_format(result.get('p95_ms')):>10}"
+                f"{_format(result.get('queries')):>10}"
+                f"{_format(result.get('peak_kib')):>10}"
+                f"{_format(result.get('per_second')):>12}"
+            )
+
+
+def compare(results, baseline, tolerance):
+    """Compare the results with those of a baseline run, returning a
+    description of each regression beyond the tolerance
+    """
+    baseline = {result["name"]: result for result in baseline}
+    regressions = []
+    for result in results:
+        base = baseline.get(result["name"])
+        if base is None:
+            continue
+        if base["calls"] != result["calls"]:
+            raise ValueError(
+                f"{result['name']} made {result['calls']} calls, but the baseline "
+                f"made {base['calls']}, run it with the same arguments"
+            )
+        for metric, higher_is_worse in METRICS:
+            value, base_value = result.get(metric), base.get(metric)
+            if value is None or not base_value:
+                continue
+            change = (value - base_value) / base_value
+            worse = change if higher_is_worse else -change
+            # query counts do not vary between runs
+            allowed = 0 if metric == "queries" else tolerance
+            if worse > allowed:
+                regressions.append(
+                    f"{result['name']} {metric}: {_format(base_value)} -> "
+                    f"{_format(value)} ({change:+.0%})"
+                )
+    return regressions
+
+
+def _format(value):
+    return "" if value is None else f"{value:.1f}"
+
+
+def webhook(type_, uuids):
+    # Django
+    from django.test import RequestFactory
+
+    # SquareletAuth
+    from squarelet_auth.views import webhook as webhook_view
+
+    timestamp = str(int(time.time()))
+    signature = hmac.new(
+        key=SECRET.encode("utf8"),
+        msg=f"{timestamp}{type_}{''.join(uuids)}".encode("utf8"),
+        digestmod=hashlib.sha256,
+    ).hexdigest()
+    request = RequestFactory().post(
+        "/squarelet/webhook/",
+        {"type": type_, "uuids": uuids, "timestamp": timestamp, "signature": signature},
+    )
+    response = webhook_view(request)
+    assert response.status_code == 200, response.status_code
+
+
+def run_benchmarks(data, args):
+    # SquareletAuth
+    from squarelet_auth.pipeline import sync_user_info
+    from squarelet_auth.tasks import pull_data
+    from squarelet_auth.users.utils import squarelet_update_or_create
+
+    benchmark = Benchmark(allocations=not args.no_allocations)
+    uuids = data.user_uuids
+    payloads = [data.user(i) for i in range(data.users)]
+
+    benchmark.run("pull_data user (create)", lambda u: pull_data("user", u), uuids)
+    benchmark.run("pull_data user (unchanged)", lambda u: pull_data("user", u), uuids)
+    benchmark.run(
+        "update_or_create user (unchanged)",
+        lambda p: squarelet_update_or_create(p["uuid"], copy.deepcopy(p)),
+        payloads,
+    )
+    benchmark.run(
+        "login sync_user_info (unchanged)",
+        lambda p: sync_user_info(response=copy.deepcopy(p)),
+        payloads,
+    )
+    benchmark.run(
+        "pull_data organization (unchanged)",
+        lambda u: pull_data("organization", u),
+        data.org_uuids,
+    )
+
+    batches = [
+        uuids[i : i + args.webhook_batch]
+        for i in range(0, len(uuids), args.webhook_batch)
+    ]
+    benchmark.throughput(
+        "webhook to applied (users)", lambda b: webhook("user", b), batches
+    )
+
+    benchmark.report()
+    if args.json:
+        with open(args.json, "w", encoding="utf8") as json_file:
+            json.dump(benchmark.results, json_file, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf8") as json_file:
+            baseline = json.load(json_file)
+        return compare(benchmark.results, baseline, args.tolerance)
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--organizations", type=int, default=50)
+    parser.add_argument("--orgs-per-user", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0, help="In seconds")
+    parser.add_argument("--webhook-batch", type=int, default=100)
+    parser.add_argument("--no-allocations", action="store_true")
+    parser.add_argument("--json", help="Also write the results to this file")
+    parser.add_argument(
+        "--baseline", help="Fail if the results regressed from those in this file"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="How much worse than the baseline results may be, as a fraction",
+    )
+    args = parser.parse_args()
+
+    if not args.no_allocations:
+        tracemalloc.start()
+
+    data = SyntheticData(args.users, args.organizations, args.orgs_per_user)
+    with FakeSquarelet(data, args.latency) as server:
+        configure(server.url, args)
+        old_name = create_database()
+        try:
+            regressions = run_benchmarks(data, args)
+        finally:
+            destroy_database(old_name)
+
+    if regressions:
+        print(f"\nRegressions from {args.baseline}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
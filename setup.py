@@ -23,7 +23,8 @@ setuptools.setup(
         "celery",
         "django",
         "requests",
-        "social-auth-core[openidconnect]",
+        "social-auth-core[openidconnect]<5",
     ],
+    extras_require={"async": ["httpx"]},
     python_requires=">=3.6",
 )
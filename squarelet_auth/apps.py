@@ -13,3 +13,17 @@ class SquareletAuthConfig(AppConfig):
         from django.contrib import admin
 
         admin.site.login = login_required(admin.site.login)
+
+        # local changes invalidate the stored cache validators, so the next
+        # pull fetches the full data again
+        from django.contrib.auth import get_user_model
+        from django.db.models.signals import post_delete, post_save
+        from squarelet_auth.organizations import get_organization_model
+        from squarelet_auth.users.utils import clear_user_validators
+        from squarelet_auth.utils import clear_organization_validators
+
+        for signal in (post_save, post_delete):
+            signal.connect(clear_user_validators, sender=get_user_model())
+            signal.connect(
+                clear_organization_validators, sender=get_organization_model()
+            )
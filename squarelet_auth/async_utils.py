@@ -0,0 +1,149 @@
+"""Asyncio counterparts of the squarelet API helpers in squarelet_auth.utils
+
+Requires httpx, which can be installed with the `async` extra
+"""
+
+# Standard Library
+import asyncio
+import logging
+import time
+import weakref
+
+# Third Party
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+
+# SquareletAuth
+from squarelet_auth import settings, throttling, utils
+
+logger = logging.getLogger(__name__)
+
+# clients and locks are bound to the event loop they were created on
+_clients = weakref.WeakKeyDictionary()
+_token_locks = weakref.WeakKeyDictionary()
+
+
+def get_squarelet_client():
+    """Get the connection pooled client for the running event loop"""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(
+                max_connections=settings.HTTP_POOL_SIZE,
+                max_keepalive_connections=settings.HTTP_POOL_SIZE,
+            ),
+            retries=settings.HTTP_MAX_RETRIES,
+        )
+        client = httpx.AsyncClient(
+            transport=transport,
+            timeout=httpx.Timeout(
+                settings.HTTP_READ_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT
+            ),
+            headers={"X-Bypass-Rate-Limit": settings.BYPASS_RATE_LIMIT_SECRET},
+        )
+        _clients[loop] = client
+    return client
+
+
+async def get_squarelet_access_token():
+    """Get an access token for squarelet
+
+    Shares the process memory tier with the synchronous version.  Concurrent
+    coroutines on the same event loop wait on a single load of the token,
+    which is run in a thread using the synchronous version's shared cache
+    lock, so only one token request is made across processes.
+    """
+    # pylint: disable=protected-access
+    token = utils._token
+    if utils._is_fresh(token, settings.TOKEN_REFRESH_AHEAD):
+        return token[0]
+    if utils._is_fresh(token, settings.TOKEN_EXPIRY_MARGIN):
+        utils.run_in_background(
+            "access-token",
+            lambda: utils._load_access_token(settings.TOKEN_REFRESH_AHEAD),
+        )
+        return token[0]
+
+    loop = asyncio.get_running_loop()
+    lock = _token_locks.setdefault(loop, asyncio.Lock())
+    async with lock:
+        token = utils._token
+        if not utils._is_fresh(token, settings.TOKEN_EXPIRY_MARGIN):
+            token = await _in_thread(utils._load_access_token)(
+                settings.TOKEN_EXPIRY_MARGIN
+            )
+    return token[0]
+
+
+async def _squarelet(method, path, **kwargs):
+    """Helper function for squarelet requests"""
+    api_url = f"{settings.SQUARELET_URL}{path}"
+    access_token = await get_squarelet_access_token()
+    headers = {"Authorization": f"Bearer {access_token}"}
+    return await _request(method, api_url, headers=headers, **kwargs)
+
+
+async def _request(method, url, **kwargs):
+    """Make a request to squarelet using the event loop's client, subject to
+    the rate limiter and circuit breaker
+    """
+    # check the circuit first, so requests fail fast while it is open.  It
+    # is usually known to be closed without reading the cache
+    probe = False
+    if settings.CIRCUIT_FAILURE_THRESHOLD and not throttling.circuit_closed():
+        probe = await _in_thread(throttling.check_circuit)()
+
+    if settings.RATE_LIMIT:
+        deadline = time.time() + settings.RATE_LIMIT_MAX_WAIT
+        wait = await _in_thread(throttling.rate_limit_wait)()
+        while wait:
+            if time.time() + wait > deadline:
+                await _in_thread(throttling.release_probe)(probe)
+                raise throttling.RateLimitError("Rate limit for squarelet reached")
+            await asyncio.sleep(wait)
+            wait = await _in_thread(throttling.rate_limit_wait)()
+
+    try:
+        resp = await get_squarelet_client().request(method, url, **kwargs)
+    except httpx.TransportError as exc:
+        await _in_thread(throttling.record_failure)(probe)
+        raise requests_error(exc) from exc
+    except httpx.HTTPError as exc:
+        raise requests_error(exc) from exc
+    if resp.status_code >= 500:
+        await _in_thread(throttling.record_failure)(probe)
+    elif probe or throttling.has_failures():
+        await _in_thread(throttling.record_success)(probe)
+    return resp
+
+
+def requests_error(exc):
+    """Convert an httpx error to the requests error the synchronous version
+    would raise, so callers can handle errors from both the same way
+    """
+    if isinstance(exc, httpx.HTTPStatusError):
+        return requests.exceptions.HTTPError(str(exc), response=exc.response)
+    if isinstance(exc, httpx.TimeoutException):
+        return requests.exceptions.Timeout(str(exc))
+    if isinstance(exc, httpx.TransportError):
+        return requests.exceptions.ConnectionError(str(exc))
+    return requests.exceptions.RequestException(str(exc))
+
+
+def _in_thread(func):
+    """Run a blocking cache or token operation outside of the event loop"""
+    return sync_to_async(func, thread_sensitive=False)
+
+
+async def squarelet_post(path, data):
+    """Make a post request to squarlet"""
+    return await _squarelet("POST", path, data=data)
+
+
+async def squarelet_get(path, params=None):
+    """Make a get request to squarlet"""
+    if params is None:
+        params = {}
+    return await _squarelet("GET", path, params=params)
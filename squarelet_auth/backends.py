@@ -2,11 +2,79 @@
 Backend to support OIDC login through Squarelet
 """
 
+# Django
+from django.core.cache import cache
+
+# Standard Library
+import functools
+import time
+
 # Third Party
+import requests
 from social_core.backends.open_id_connect import OpenIdConnectAuth
+from social_core.exceptions import AuthUnreachableProvider
 
 # SquareletAuth
 from squarelet_auth import settings
+from squarelet_auth.throttling import (
+    CircuitOpenError,
+    check_circuit,
+    record_failure,
+    record_success,
+)
+from squarelet_auth.utils import run_in_background
+
+
+def shared_cache(key):
+    """Cache a backend method's result in process memory and in the shared
+    cache, so new processes do not need to fetch it
+
+    Once the result is older than SQUARELET_OIDC_REFRESH_AGE it is refreshed
+    in the background while the current result keeps being served.  Like
+    social_core's `cache` decorator, the wrapped method has an `invalidate`
+    function, which forces the next call to fetch a fresh result.
+    """
+
+    def decorator(func):
+        # the (result, fetched at) pair for this process
+        memo = {}
+
+        def fetch(backend):
+            entry = (func(backend), time.time())
+            cache.set(key, entry, settings.OIDC_CACHE_TIMEOUT)
+            memo["entry"] = entry
+            return entry
+
+        def refresh(backend):
+            # another process may have already refreshed it
+            entry = cache.get(key)
+            if entry is not None and _age(entry) < settings.OIDC_REFRESH_AGE:
+                memo["entry"] = entry
+            else:
+                fetch(backend)
+
+        @functools.wraps(func)
+        def wrapped(backend):
+            entry = memo.get("entry")
+            if entry is None:
+                entry = cache.get(key) or fetch(backend)
+                memo["entry"] = entry
+            if _age(entry) > settings.OIDC_REFRESH_AGE:
+                run_in_background(key, lambda: refresh(backend))
+            return entry[0]
+
+        def invalidate():
+            memo.clear()
+            cache.delete(key)
+
+        wrapped.invalidate = invalidate
+        return wrapped
+
+    return decorator
+
+
+def _age(entry):
+    return time.time() - entry[1]
 
 
 class SquareletBackend(OpenIdConnectAuth):
@@ -15,9 +83,77 @@ class SquareletBackend(OpenIdConnectAuth):
     # pylint: disable=abstract-method
     name = "squarelet"
     OIDC_ENDPOINT = settings.SQUARELET_URL + "/openid"
+    # the claims the ID token must carry to be used in place of userinfo, in
+    # addition to every user field synced from squarelet
+    ID_TOKEN_USER_CLAIMS = ("uuid", "organizations")
 
     def auth_allowed(self, response, details):
         if settings.WHITELIST_VERIFIED_JOURNALISTS:
             return any(o["verified_journalist"] for o in response["organizations"])
         else:
             return True
+
+    def user_data(self, access_token, *args, **kwargs):
+        """Use the verified ID token's claims as the user's data if they are
+        complete, to skip the request to the userinfo endpoint
+
+        Missing user fields would be synced as their defaults, so the claims
+        are only used if they include all of them
+        """
+        if settings.USE_ID_TOKEN_CLAIMS:
+            from squarelet_auth.users.utils import USER_MAP
+
+            # set by social core once the ID token has been validated
+            claims = getattr(self, "id_token", None)
+            required = self.ID_TOKEN_USER_CLAIMS + tuple(USER_MAP)
+            if claims and all(c in claims for c in required):
+                return dict(claims)
+        return super().user_data(access_token, *args, **kwargs)
+
+    def request(self, url, *args, **kwargs):
+        """Make social core's requests to squarelet, such as discovery, the
+        token exchange and userinfo, with our timeouts and subject to the
+        circuit breaker
+        """
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = (
+                settings.HTTP_CONNECT_TIMEOUT,
+                settings.HTTP_READ_TIMEOUT,
+            )
+        try:
+            probe = check_circuit()
+        except CircuitOpenError as exc:
+            raise AuthUnreachableProvider(self) from exc
+        try:
+            response = super().request(url, *args, **kwargs)
+        except requests.exceptions.HTTPError as exc:
+            if exc.response is not None and exc.response.status_code >= 500:
+                record_failure(probe)
+            else:
+                record_success(probe)
+            raise
+        except Exception as exc:
+            # social core re-raises connection errors as its own exceptions
+            if isinstance(exc, requests.exceptions.RequestException) or isinstance(
+                exc.__context__, requests.exceptions.RequestException
+            ):
+                record_failure(probe)
+            raise
+        record_success(probe)
+        return response
+
+    @shared_cache("squarelet_auth:oidc_config")
+    def oidc_config(self):
+        return self.get_json(self.oidc_endpoint() + "/.well-known/openid-configuration")
+
+    @shared_cache("squarelet_auth:jwks")
+    def get_remote_jwks_keys(self):
+        return super().get_remote_jwks_keys()
+
+    def get_jwks_keys(self):
+        # social core may modify the keys, so do not return the cached ones
+        return [dict(key) for key in self.get_remote_jwks_keys()]
+
+    # social core invalidates the keys when it sees an unknown key ID,
+    # which forces the remote keys to be fetched again immediately
+    get_jwks_keys.invalidate = get_remote_jwks_keys.invalidate
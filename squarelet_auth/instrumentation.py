@@ -0,0 +1,169 @@
+"""Instrumentation for the phases of syncing data from squarelet
+
+Backends are configured with SQUARELET_INSTRUMENTATION_BACKENDS, a list of
+dotted paths to classes with a `timing(phase, duration, queries)` method
+and an `observe(metric, value)` method.  When no backends are configured,
+`phase` returns a shared no-op context manager, so instrumentation costs
+nothing when it is disabled.
+
+The phases are:
+
+    pull           a whole pull_data task for a single object
+    token          acquiring an access token
+    http           a request to squarelet
+    decode         decoding a JSON response from squarelet
+    user           updating or creating a user row
+    organizations  syncing a user's organizations and memberships
+    organization   updating or creating an organization
+    user_update    running the user_update signal receivers
+
+The metrics, all in seconds, are:
+
+    webhook.queue_delay  from when a pull task was due to run to when it started
+    webhook.fetch        fetching the data for a pull task
+    webhook.lag          from squarelet sending a webhook to the data being
+                         committed, recorded once per object
+"""
+
+# Django
+import django.dispatch
+from django.db import connection
+from django.utils.module_loading import import_string
+
+# Standard Library
+import time
+
+# SquareletAuth
+from squarelet_auth import settings
+
+phase_timing = django.dispatch.Signal()
+metric_observed = django.dispatch.Signal()
+
+
+class _NullPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_PHASE = _NullPhase()
+
+
+def phase(name):
+    """Time the code run in this context as the given phase"""
+    if not _backends:
+        return _NULL_PHASE
+    return _Phase(name)
+
+
+def observe(metric, value):
+    """Record a single observation of a metric"""
+    for backend in _backends:
+        backend.observe(metric, value)
+
+
+class _Phase:
+    """Measure the wall time and number of queries of a phase"""
+
+    def __init__(self, name):
+        self.name = name
+        self.queries = 0
+        self.start = None
+        self.wrapper = connection.execute_wrapper(self._count_query)
+
+    def _count_query(self, execute, sql, params, many, context):
+        # pylint: disable=too-many-arguments
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self.wrapper.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.start
+        self.wrapper.__exit__(*exc_info)
+        for backend in _backends:
+            backend.timing(self.name, duration, self.queries)
+
+
+class SignalBackend:
+    """Send the `phase_timing` signal for every phase"""
+
+    def timing(self, phase_, duration, queries):
+        phase_timing.send(
+            sender=self.__class__, phase=phase_, duration=duration, queries=queries
+        )
+
+    def observe(self, metric, value):
+        metric_observed.send(sender=self.__class__, metric=metric, value=value)
+
+
+class StatsdBackend:
+    """Report phases as StatsD timers, using the statsd package
+
+    Configured with the STATSD_HOST, STATSD_PORT and STATSD_PREFIX settings
+    """
+
+    def __init__(self):
+        from django.conf import settings as django_settings
+        import statsd
+
+        self.client = statsd.StatsClient(
+            getattr(django_settings, "STATSD_HOST", "localhost"),
+            getattr(django_settings, "STATSD_PORT", 8125),
+            prefix=getattr(django_settings, "STATSD_PREFIX", None),
+        )
+
+    def timing(self, phase_, duration, queries):
+        self.client.timing(f"squarelet_auth.{phase_}.time", duration * 1000)
+        self.client.timing(f"squarelet_auth.{phase_}.queries", queries)
+
+    def observe(self, metric, value):
+        self.client.timing(f"squarelet_auth.{metric}", value * 1000)
+
+
+class PrometheusBackend:
+    """Report phases as Prometheus histograms, using the prometheus_client
+    package
+    """
+
+    duration_histogram = None
+    queries_histogram = None
+    metric_histogram = None
+
+    def __init__(self):
+        from prometheus_client import Histogram
+
+        # metrics may only be registered once per process
+        if PrometheusBackend.duration_histogram is None:
+            PrometheusBackend.duration_histogram = Histogram(
+                "squarelet_auth_phase_seconds",
+                "Time spent in each phase of syncing data from squarelet",
+                ["phase"],
+            )
+            PrometheusBackend.queries_histogram = Histogram(
+                "squarelet_auth_phase_queries",
+                "Database queries made in each phase of syncing data from squarelet",
+                ["phase"],
+                buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, float("inf")),
+            )
+            PrometheusBackend.metric_histogram = Histogram(
+                "squarelet_auth_metric_seconds",
+                "Delays in applying data from squarelet",
+                ["metric"],
+                buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, float("inf")),
+            )
+
+    def timing(self, phase_, duration, queries):
+        self.duration_histogram.labels(phase_).observe(duration)
+        self.queries_histogram.labels(phase_).observe(queries)
+
+    def observe(self, metric, value):
+        self.metric_histogram.labels(metric).observe(value)
+
+
+_backends = [import_string(path)() for path in settings.INSTRUMENTATION_BACKENDS]
@@ -0,0 +1,28 @@
+"""Repair users' active organization pointers"""
+
+# Django
+from django.core.management.base import BaseCommand
+
+# SquareletAuth
+from squarelet_auth.users.utils import repair_active_organizations
+
+
+class Command(BaseCommand):
+    help = (
+        "Check that each user's active organization matches their active "
+        "membership, and fix the users where it does not"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report the number of users which are out of sync",
+        )
+
+    def handle(self, *args, **options):
+        count = repair_active_organizations(dry_run=options["dry_run"])
+        if options["dry_run"]:
+            self.stdout.write(f"{count} users are out of sync")
+        else:
+            self.stdout.write(f"Repaired {count} users")
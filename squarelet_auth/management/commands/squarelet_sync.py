@@ -0,0 +1,187 @@
+"""Bulk load all users and organizations from squarelet"""
+
+# Django
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, OperationalError, connections
+
+# Standard Library
+import json
+import logging
+import multiprocessing
+import os
+import random
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# SquareletAuth
+from squarelet_auth.organizations.utils import (
+    squarelet_bulk_update_or_create as organization_bulk_update_or_create,
+)
+from squarelet_auth.users.utils import (
+    squarelet_bulk_update_or_create as user_bulk_update_or_create,
+)
+from squarelet_auth.utils import squarelet_get_pages
+
+TYPES_PATH = {
+    "organizations": "/api/organizations/",
+    "users": "/api/users/",
+}
+TYPES_UPDATE = {
+    "organizations": organization_bulk_update_or_create,
+    "users": user_bulk_update_or_create,
+}
+DONE = "done"
+FAILED = "failed"
+# attempts for errors which may be caused by other workers saving the same
+# organizations at the same time
+ATTEMPTS = 3
+
+logger = logging.getLogger(__name__)
+
+
+def sync_chunk(type_, data_list):
+    """Upsert one chunk of data, run in a worker process
+
+    If the chunk fails, its objects are saved one at a time so a bad record
+    only fails itself.  Returns the number of objects saved and the UUIDs of
+    those which failed.
+    """
+    try:
+        _with_retries(TYPES_UPDATE[type_], data_list)
+        return len(data_list), []
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Failed to sync a chunk of %s, saving individually", type_)
+
+    failed = []
+    for data in data_list:
+        try:
+            _with_retries(TYPES_UPDATE[type_], [data])
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Failed to sync %s %s", type_, data.get("uuid"))
+            failed.append(str(data.get("uuid")))
+    return len(data_list) - len(failed), failed
+
+
+def _with_retries(func, data_list):
+    for attempt in range(ATTEMPTS - 1):
+        try:
+            return func(data_list)
+        except (IntegrityError, OperationalError):
+            time.sleep(random.uniform(0, 2**attempt))
+    return func(data_list)
+
+
+class Command(BaseCommand):
+    help = (
+        "Load or re-sync all users and organizations from squarelet.  "
+        "Objects are created even if SQUARELET_DISABLE_CREATE is set.  Objects "
+        "which fail to save are reported at the end, and kept in the checkpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--type",
+            choices=["all", "organizations", "users"],
+            default="all",
+            help="Which objects to sync, organizations are synced before users",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=500,
+            help="The number of objects to fetch and save at a time",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=1,
+            help="The number of worker processes to save chunks in",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            help="A file to record progress in.  If it exists, the sync resumes "
+            "from where it left off",
+        )
+
+    def handle(self, *args, **options):
+        checkpoint = self._load_checkpoint(options["checkpoint"])
+        if options["type"] == "all":
+            types = ["organizations", "users"]
+        else:
+            types = [options["type"]]
+
+        for type_ in types:
+            if checkpoint.get(type_) == DONE:
+                self.stdout.write(f"Skipping {type_}, already synced")
+                continue
+            self._sync(type_, checkpoint, options)
+            checkpoint[type_] = DONE
+            self._save_checkpoint(options["checkpoint"], checkpoint)
+
+        failed = checkpoint.get(FAILED, {})
+        for type_, uuids in failed.items():
+            self.stderr.write(f"Failed to sync {len(uuids)} {type_}: {' '.join(uuids)}")
+
+    def _sync(self, type_, checkpoint, options):
+        """Stream pages of the listing into worker processes
+
+        The checkpoint is only advanced past a page once it and every page
+        before it have been saved, so a resumed sync never skips a chunk
+        """
+        path = checkpoint.get(type_)
+        params = None
+        if path is None:
+            path = TYPES_PATH[type_]
+            params = {"page_size": options["chunk_size"]}
+        else:
+            self.stdout.write(f"Resuming {type_} from {path}")
+
+        # do not share database connections with the worker processes
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        total = 0
+        pending = deque()
+        with ProcessPoolExecutor(
+            max_workers=options["processes"],
+            mp_context=context,
+            initializer=connections.close_all,
+        ) as executor:
+            for data_list, next_path in squarelet_get_pages(path, params):
+                pending.append(
+                    (executor.submit(sync_chunk, type_, data_list), next_path)
+                )
+                # bound the number of chunks held in memory
+                while len(pending) > 2 * options["processes"]:
+                    total += self._finish_chunk(type_, pending, checkpoint, options)
+            while pending:
+                total += self._finish_chunk(type_, pending, checkpoint, options)
+
+        self.stdout.write(f"Synced {total} {type_}")
+
+    def _finish_chunk(self, type_, pending, checkpoint, options):
+        """Wait for the oldest chunk to be saved and checkpoint past it"""
+        future, next_path = pending.popleft()
+        count, failed = future.result()
+        if failed:
+            checkpoint.setdefault(FAILED, {}).setdefault(type_, []).extend(failed)
+        if next_path or failed:
+            if next_path:
+                checkpoint[type_] = next_path
+            self._save_checkpoint(options["checkpoint"], checkpoint)
+        return count
+
+    def _load_checkpoint(self, path):
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as checkpoint_file:
+                return json.load(checkpoint_file)
+        return {}
+
+    def _save_checkpoint(self, path, checkpoint):
+        if not path:
+            return
+        # write atomically so a crash never leaves a partial checkpoint
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+        os.replace(tmp_path, path)
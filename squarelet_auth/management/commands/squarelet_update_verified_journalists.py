@@ -0,0 +1,28 @@
+"""Compute users' verified journalist flags"""
+
+# Django
+from django.core.management.base import BaseCommand
+
+# SquareletAuth
+from squarelet_auth.organizations.models import update_verified_journalists
+
+
+class Command(BaseCommand):
+    help = (
+        "Compute the stored verified journalist flag for users who do not have "
+        "one yet, such as users created before it was added"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Recompute the flag for every user, not only those without one",
+        )
+
+    def handle(self, *args, **options):
+        if options["all"]:
+            update_verified_journalists()
+        else:
+            update_verified_journalists(is_verified_journalist=None)
+        self.stdout.write("Updated verified journalist flags")
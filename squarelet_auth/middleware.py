@@ -0,0 +1,34 @@
+"""Middleware for squarelet auth app"""
+
+# Django
+from django.contrib.auth.middleware import get_user
+from django.utils.functional import SimpleLazyObject
+
+# SquareletAuth
+from squarelet_auth.users.utils import prefetch_active_organization
+
+
+def _get_user(request):
+    user = get_user(request)
+    # users with an active organization pointer load it from there when it is
+    # first used, so only prefetch for the users without one
+    if user.pk is not None and user.active_organization_id is None:
+        prefetch_active_organization(user)
+    return user
+
+
+class ActiveOrganizationMiddleware:
+    """Load the active organization along with `request.user`, for users
+    without an active organization pointer
+
+    Place this after django.contrib.auth.middleware.AuthenticationMiddleware.
+    The user and their active organization are still only loaded when
+    `request.user` is first accessed.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.user = SimpleLazyObject(lambda: _get_user(request))
+        return self.get_response(request)
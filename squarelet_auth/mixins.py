@@ -3,11 +3,16 @@ from django.contrib.auth import login
 
 # Third Party
 import requests
+from asgiref.sync import sync_to_async
 
 # SquareletAuth
 from squarelet_auth.users.utils import squarelet_update_or_create
 from squarelet_auth.utils import squarelet_post
 
+GENERIC_ERROR = (
+    "Sorry, something went wrong with the user service.  Please try again later"
+)
+
 
 class MiniregMixin:
     """A mixin to expose miniregister functionality to a view"""
@@ -17,39 +22,75 @@ class MiniregMixin:
 
     def _create_squarelet_user(self, form, data):
         """Create a corresponding user on squarelet"""
-
-        generic_error = (
-            "Sorry, something went wrong with the user service.  "
-            "Please try again later"
-        )
-
         try:
             resp = squarelet_post("/api/users/", data=data)
         except requests.exceptions.RequestException:
-            form.add_error(None, generic_error)
+            form.add_error(None, GENERIC_ERROR)
             raise
-        if resp.status_code / 100 != 2:
+        return self._handle_squarelet_response(form, resp)
+
+    def _handle_squarelet_response(self, form, resp):
+        """Add any errors from squarelet to the form and return the user data"""
+        if resp.status_code // 100 != 2:
             try:
                 error_json = resp.json()
             except ValueError:
-                form.add_error(None, generic_error)
+                form.add_error(None, GENERIC_ERROR)
             else:
-                for field, errors in error_json.iteritems():
+                for field, errors in error_json.items():
                     for error in errors:
                         form.add_error(self.field_map.get(field, field), error)
             finally:
                 resp.raise_for_status()
         return resp.json()
 
-    def miniregister(self, form, full_name, email):
-        """Create a new user from their full name and email"""
+    def _miniregister_data(self, full_name, email):
         full_name = full_name.strip()
+        return {"name": full_name, "preferred_username": full_name, "email": email}
 
+    def _login_squarelet_user(self, user_json):
+        """Create the local user and log them in"""
+        user, _ = squarelet_update_or_create(user_json["uuid"], user_json)
+        login(self.request, user, backend="squarelet_auth.backends.SquareletBackend")
+        return user
+
+    def miniregister(self, form, full_name, email):
+        """Create a new user from their full name and email"""
         user_json = self._create_squarelet_user(
-            form, {"name": full_name, "preferred_username": full_name, "email": email}
+            form, self._miniregister_data(full_name, email)
         )
+        return self._login_squarelet_user(user_json)
 
-        user, _ = squarelet_update_or_create(user_json["uuid"], user_json)
-        login(self.request, user, backend="squarelet_auth.backends.SquareletBackend")
 
-        return user
+class AsyncMiniregMixin(MiniregMixin):
+    """A mixin to expose miniregister functionality to an async view
+
+    The request to squarelet is made natively on the event loop, only the
+    database work and login are run in a thread.  Requires httpx.
+    """
+
+    async def _acreate_squarelet_user(self, form, data):
+        """Create a corresponding user on squarelet
+
+        Errors are raised as the same requests exceptions as the synchronous
+        version
+        """
+        import httpx
+        from squarelet_auth import async_utils
+
+        try:
+            resp = await async_utils.squarelet_post("/api/users/", data=data)
+        except requests.exceptions.RequestException:
+            form.add_error(None, GENERIC_ERROR)
+            raise
+        try:
+            return self._handle_squarelet_response(form, resp)
+        except httpx.HTTPError as exc:
+            raise async_utils.requests_error(exc) from exc
+
+    async def aminiregister(self, form, full_name, email):
+        """Create a new user from their full name and email"""
+        user_json = await self._acreate_squarelet_user(
+            form, self._miniregister_data(full_name, email)
+        )
+        return await sync_to_async(self._login_squarelet_user)(user_json)
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.9 on 2026-10-17 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('squarelet_auth_organizations', '0008_alter_entitlement_resources'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='organization',
+            name='squarelet_hash',
+            field=models.CharField(blank=True, editable=False, help_text='A fingerprint of the data last applied from squarelet', max_length=64, verbose_name='squarelet hash'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.9 on 2026-10-17 09:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('squarelet_auth_organizations', '0009_organization_squarelet_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='organization',
+            name='squarelet_synced_at',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Timestamp of when changed data from squarelet was last applied', null=True, verbose_name='squarelet synced at'),
+        ),
+    ]
@@ -1,14 +1,25 @@
 # Django
-from django.db import models
+from django.apps import apps
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import BooleanField, Exists, OuterRef, Subquery, Value
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 # Standard Library
 import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from uuid import uuid4
 
 # SquareletAuth
 from squarelet_auth import settings
+from squarelet_auth.utils import clear_validators, payload_hash
 
 logger = logging.getLogger(__name__)
 
@@ -48,6 +59,155 @@ class Membership(models.Model):
         return f"{self.user} in {self.organization}"
 
 
+_membership_sync = threading.local()
+
+
+@contextmanager
+def syncing_memberships():
+    """Membership changes made in this context are being made by the sync,
+    which keeps the users' derived fields and indexes up to date itself, so
+    this package's membership receivers skip them
+
+    Other receivers of the membership signals are still sent them
+    """
+    previous = getattr(_membership_sync, "active", False)
+    _membership_sync.active = True
+    try:
+        yield
+    finally:
+        _membership_sync.active = previous
+
+
+def _users():
+    """The default manager of the user model, which may be swapped"""
+    # pylint: disable=protected-access
+    return apps.get_model(settings.AUTH_USER_MODEL)._default_manager
+
+
+@receiver(post_save, sender=Membership)
+@receiver(post_delete, sender=Membership)
+def invalidate_membership_index(instance, **kwargs):
+    """Clear the membership index and update the verified journalist flag and
+    active organization of a user whose memberships changed
+
+    Their cache validators are also cleared, so the next pull repairs any
+    drift from squarelet's data
+    """
+    # pylint: disable=unused-argument
+    if getattr(_membership_sync, "active", False):
+        return
+    if Membership.user.is_cached(instance):
+        instance.user.__dict__.pop("_membership_index", None)
+        uuid = instance.user.uuid
+    else:
+        uuid = (
+            _users().filter(pk=instance.user_id).values_list("uuid", flat=True).first()
+        )
+    if uuid is not None:
+        clear_validators("user", uuid)
+    update_verified_journalists(pk=instance.user_id)
+    update_active_organizations(pk=instance.user_id)
+    memberships_changed([instance.user_id])
+
+
+def update_verified_journalists(**filters):
+    """Recompute the verified journalist flag of the users matching the
+    filters, or of all users, in a single query
+
+    The sync sets the flag itself, this is for changes made outside of it
+    """
+    verified = Membership.objects.filter(
+        user=OuterRef("pk"), organization__verified_journalist=True
+    )
+    _users().filter(**filters).update(is_verified_journalist=Exists(verified))
+
+
+def organization_data_hash(data):
+    """Hash the organization data from squarelet, to detect when it has not
+    changed since it was last applied
+    """
+    # admin is specific to the user whose data embedded this organization
+    return payload_hash(data, exclude=("admin",))
+
+
+def update_active_organizations(**filters):
+    """Point the users matching the filters, or all users, at the
+    organization of their active membership in a single query, or clear the
+    pointer if they have none
+
+    The sync sets the pointer itself, this is for changes made outside of it
+    """
+    active = Membership.objects.filter(user=OuterRef("pk"), active=True).values(
+        "organization_id"
+    )[:1]
+    _users().filter(**filters).update(active_organization=Subquery(active))
+
+
+def membership_index_key(user_id, generation):
+    return f"squarelet_auth:membership_index:{user_id}:{generation}"
+
+
+def _membership_generation_key(user_id):
+    return f"squarelet_auth:membership_generation:{user_id}"
+
+
+def get_membership_generation(user_id):
+    """Get the current generation of a user's cached membership index
+
+    Generations are random, so if the key is evicted the new generation
+    cannot match an index cached for an earlier one
+    """
+    key = _membership_generation_key(user_id)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, uuid4().hex, settings.MEMBERSHIP_CACHE_TIMEOUT)
+        generation = cache.get(key)
+    return generation
+
+
+class _MembershipsCommitted:
+    """Commit hook replacing the users' membership index generations"""
+
+    def __init__(self, user_ids):
+        self.user_ids = user_ids
+
+    def __call__(self):
+        cache.set_many(
+            {
+                _membership_generation_key(user_id): uuid4().hex
+                for user_id in self.user_ids
+            },
+            settings.MEMBERSHIP_CACHE_TIMEOUT,
+        )
+
+
+def memberships_changed(user_ids):
+    """Record that the users' memberships were changed in the current
+    transaction
+
+    Their cached membership indexes are replaced with a new generation once
+    the transaction commits, and are not used within it until then
+    """
+    user_ids = set(user_ids)
+    if user_ids:
+        transaction.on_commit(_MembershipsCommitted(user_ids))
+
+
+def memberships_changed_in_transaction(user_id):
+    """Have the user's memberships been changed in the current transaction?
+
+    The changes are read from the transaction's pending commit hooks, which
+    Django discards along with any rolled back transaction or savepoint
+    """
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        return False
+    return any(
+        isinstance(hook, _MembershipsCommitted) and user_id in hook.user_ids
+        for _sids, hook, *_ in connection.run_on_commit
+    )
+
+
 class Entitlement(models.Model):
     """Entitlements granted to organizations through plans"""
 
@@ -59,6 +219,68 @@ class Entitlement(models.Model):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_squarelet(cls, slug, defaults, update=True):
+        """Get the entitlement with the given slug, creating it or updating
+        it from the defaults if needed
+
+        Entitlements are cached per process for SQUARELET_ENTITLEMENT_CACHE_TIMEOUT
+        seconds, keyed by their slug and data, so unchanged entitlements are
+        resolved without a query
+        """
+        key = (slug, payload_hash(defaults), update)
+        with _entitlement_cache_lock:
+            entry = _entitlement_cache.get(key)
+            if entry is not None:
+                entitlement, cached_at = entry
+                if time.monotonic() - cached_at < settings.ENTITLEMENT_CACHE_TIMEOUT:
+                    _entitlement_cache.move_to_end(key)
+                    return entitlement
+                del _entitlement_cache[key]
+
+        entitlement, created = cls.objects.get_or_create(slug=slug, defaults=defaults)
+        if update and not created:
+            changed = False
+            for field, value in defaults.items():
+                if getattr(entitlement, field) != value:
+                    setattr(entitlement, field, value)
+                    changed = True
+            if changed:
+                entitlement.save()
+        # do not cache rows which may still be rolled back
+        transaction.on_commit(lambda: _cache_entitlement(key, entitlement))
+        return entitlement
+
+
+_entitlement_cache = OrderedDict()
+_entitlement_cache_lock = threading.Lock()
+
+
+def clear_entitlement_cache():
+    """Empty this process's entitlement cache, for example between tests which
+    delete entitlements
+    """
+    with _entitlement_cache_lock:
+        _entitlement_cache.clear()
+
+
+def _cache_entitlement(key, entitlement):
+    with _entitlement_cache_lock:
+        _entitlement_cache[key] = (entitlement, time.monotonic())
+        _entitlement_cache.move_to_end(key)
+        while len(_entitlement_cache) > settings.ENTITLEMENT_CACHE_SIZE:
+            _entitlement_cache.popitem(last=False)
+
+
+@receiver(post_save, sender=Entitlement)
+@receiver(post_delete, sender=Entitlement)
+def invalidate_entitlement_cache(instance, **kwargs):
+    """Remove a changed entitlement from this process's cache"""
+    # pylint: disable=unused-argument
+    with _entitlement_cache_lock:
+        for key in [k for k in _entitlement_cache if k[0] == instance.slug]:
+            del _entitlement_cache[key]
+
 
 # dynamically create properties for all defined resource fields
 for field_, default in settings.RESOURCE_FIELDS.items():
@@ -69,9 +291,40 @@ for field_, default in settings.RESOURCE_FIELDS.items():
     )
 
 
+def role_annotations(memberships=None):
+    """Annotations for whether a membership exists, is an admin and is active
+
+    `memberships` is a subquery of the memberships linking each row to the
+    user or organization, or None to annotate every role as False
+    """
+    if memberships is None:
+        false = Value(False, output_field=BooleanField())
+        return {"is_member": false, "is_admin": false, "is_active_member": false}
+    return {
+        "is_member": Exists(memberships),
+        "is_admin": Exists(memberships.filter(admin=True)),
+        "is_active_member": Exists(memberships.filter(active=True)),
+    }
+
+
+class OrganizationQuerySet(models.QuerySet):
+    """Custom queryset for organizations"""
+
+    def annotate_roles(self, user):
+        """Annotate whether the user is a member and an admin of each
+        organization, and whether it is their active organization
+        """
+        if user.pk is None:
+            return self.annotate(**role_annotations())
+        memberships = Membership.objects.filter(organization=OuterRef("pk"), user=user)
+        return self.annotate(**role_annotations(memberships))
+
+
 class AbstractOrganization(models.Model):
     """An orginization users can belong to"""
 
+    objects = OrganizationQuerySet.as_manager()
+
     uuid = models.UUIDField(
         _("UUID"),
         unique=True,
@@ -153,6 +406,20 @@ class AbstractOrganization(models.Model):
         default=False,
         help_text=_("This organization is a verified jorunalistic organization"),
     )
+    squarelet_hash = models.CharField(
+        _("squarelet hash"),
+        max_length=64,
+        blank=True,
+        editable=False,
+        help_text=_("A fingerprint of the data last applied from squarelet"),
+    )
+    squarelet_synced_at = models.DateTimeField(
+        _("squarelet synced at"),
+        null=True,
+        blank=True,
+        editable=False,
+        help_text=_("Timestamp of when changed data from squarelet was last applied"),
+    )
 
     class Meta:
         ordering = ("slug",)
@@ -179,14 +446,36 @@ class AbstractOrganization(models.Model):
 
     def has_member(self, user):
         """Is the user a member of this organization?"""
-        return self.users.filter(pk=user.pk).exists()
+        if user.pk is None:
+            return False
+        return self.pk in user.membership_index.members
 
     def has_admin(self, user):
         """Is the user an admin of this organization?"""
-        return self.users.filter(pk=user.pk, memberships__admin=True).exists()
+        if user.pk is None:
+            return False
+        return self.pk in user.membership_index.admins
 
     def update_data(self, data):
         """Set updated data from squarelet"""
+        update_fields = self._apply_data(data)
+        if self._state.adding:
+            self.save()
+        elif update_fields:
+            self.save(update_fields=update_fields)
+            if "verified_journalist" in update_fields:
+                update_verified_journalists(memberships__organization=self)
+
+    def _apply_data(self, data):
+        """Set updated data from squarelet on this instance without saving it
+
+        Returns the names of the fields which changed.  If the data is
+        identical to the data last applied, nothing is done.
+        """
+        squarelet_hash = organization_data_hash(data)
+        if squarelet_hash == self.squarelet_hash:
+            return []
+        original = self._field_values()
 
         if len(data["entitlements"]) > 1:
             logger.warning(
@@ -196,9 +485,9 @@ class AbstractOrganization(models.Model):
             )
         if data["entitlements"]:
             entitlement_data = self._choose_entitlement(data["entitlements"])
-            self.entitlement, _created = Entitlement.objects.update_or_create(
-                slug=entitlement_data["slug"],
-                defaults={
+            self.entitlement = Entitlement.from_squarelet(
+                entitlement_data["slug"],
+                {
                     "name": entitlement_data["name"],
                     "description": entitlement_data["description"],
                     "resources": entitlement_data["resources"],
@@ -206,8 +495,8 @@ class AbstractOrganization(models.Model):
             )
             date_update = entitlement_data["date_update"]
         else:
-            self.entitlement, _created = Entitlement.objects.get_or_create(
-                slug="free", defaults={"name": "Free"}
+            self.entitlement = Entitlement.from_squarelet(
+                "free", {"name": "Free"}, update=False
             )
             date_update = None
 
@@ -227,7 +516,18 @@ class AbstractOrganization(models.Model):
         for field in fields:
             if field in data:
                 setattr(self, field, data[field])
-        self.save()
+        self.squarelet_hash = squarelet_hash
+        self.squarelet_synced_at = timezone.now()
+
+        current = self._field_values()
+        return [name for name, value in current.items() if value != original[name]]
+
+    def _field_values(self):
+        return {
+            field.name: getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+            if not field.primary_key
+        }
 
     def _update_resources(self, data, date_update):
         """Allows subclasses to override to update their resources"""
@@ -4,17 +4,100 @@ from django.db import transaction
 # Standard Library
 import logging
 from datetime import datetime
+from uuid import UUID
 
 # SquareletAuth
+from squarelet_auth.instrumentation import phase
 from squarelet_auth.organizations import get_organization_model
+from squarelet_auth.organizations.models import (
+    organization_data_hash,
+    update_verified_journalists,
+)
 
 Organization = get_organization_model()
 logger = logging.getLogger(__name__)
 
 
+def squarelet_update_or_create(uuid, data, organization=None):
+    """Update or create records based on data from squarelet
+
+    An already loaded organization may be passed in to avoid looking it up.
+    If its data has not changed since it was last applied, nothing is done,
+    without even opening a savepoint.
+    """
+    with phase("organization"):
+        _clean_data(uuid, data)
+
+        if (
+            organization is not None
+            and organization.squarelet_hash == organization_data_hash(data)
+        ):
+            return organization, False
+
+        return _update_or_create(uuid, data, organization)
+
+
 @transaction.atomic
-def squarelet_update_or_create(uuid, data):
-    """Update or create records based on data from squarelet"""
+def _update_or_create(uuid, data, organization):
+    if organization is None:
+        organization, created = Organization.objects.get_or_create(uuid=uuid)
+    else:
+        created = False
+    organization.update_data(data)
+    return organization, created
+
+
+@transaction.atomic
+def squarelet_bulk_update_or_create(data_list):
+    """Update or create many organizations based on data from squarelet,
+    using a constant number of queries
+
+    Returns a dictionary of the organizations keyed by UUID
+    """
+    data_by_uuid = {}
+    for data in data_list:
+        _clean_data(data["uuid"], data)
+        data_by_uuid[UUID(str(data["uuid"]))] = data
+
+    organizations = Organization.objects.in_bulk(data_by_uuid.keys(), field_name="uuid")
+    new_organizations = []
+    changed_organizations = []
+    update_fields = set()
+    verified = {}
+    for uuid, data in data_by_uuid.items():
+        organization = organizations.get(uuid)
+        if organization is None:
+            organization = Organization(uuid=uuid)
+            # pylint: disable=protected-access
+            organization._apply_data(data)
+            new_organizations.append(organization)
+            organizations[uuid] = organization
+        else:
+            verified[organization.pk] = organization.verified_journalist
+            # pylint: disable=protected-access
+            changed_fields = organization._apply_data(data)
+            if changed_fields:
+                changed_organizations.append(organization)
+                update_fields.update(changed_fields)
+
+    if new_organizations:
+        Organization.objects.bulk_create(new_organizations)
+    if changed_organizations:
+        Organization.objects.bulk_update(changed_organizations, update_fields)
+    if "verified_journalist" in update_fields:
+        update_verified_journalists(
+            memberships__organization__in=[
+                organization.pk
+                for organization in changed_organizations
+                if organization.verified_journalist != verified[organization.pk]
+            ]
+        )
+
+    return organizations
+
+
+def _clean_data(uuid, data):
+    """Check the data from squarelet for required fields and convert dates"""
     required_fields = {"name", "slug", "entitlements", "max_users", "individual"}
     missing = required_fields - (required_fields & set(data.keys()))
     if missing:
@@ -48,8 +131,3 @@ def squarelet_update_or_create(uuid, data):
                 uuid,
                 entitlement_data["update_on"],
             )
-
-    organization, created = Organization.objects.get_or_create(uuid=uuid)
-    organization.update_data(data)
-
-    return organization, created
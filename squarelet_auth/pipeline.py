@@ -1,14 +1,22 @@
 """
 Custom pipeline steps for oAuth authentication
 """
+
 # Django
 from django.contrib.auth import get_user_model
+from django.db import transaction
 
 # Standard Library
 import logging
 
 # SquareletAuth
-from squarelet_auth.users.utils import squarelet_update_or_create
+from squarelet_auth import settings
+from squarelet_auth.tasks import sync_user
+from squarelet_auth.users.utils import (
+    squarelet_update_or_create,
+    squarelet_update_user,
+    user_data_hash,
+)
 
 User = get_user_model()
 
@@ -17,6 +25,21 @@ logger = logging.getLogger(__name__)
 # pylint: disable=inconsistent-return-statements
 
 
+def sync_user_info(response, user=None, *args, **kwargs):
+    """Associate current auth with the user with the same uuid in the DB, and
+    update their info based on information from squarelet
+
+    This combines `associate_by_uuid` and `save_info`, looking the user up at
+    most once.  A user already found by an earlier step is reused if their
+    uuid matches.
+    """
+    # pylint: disable=unused-argument,keyword-arg-before-vararg
+    uuid = response["uuid"]
+    if user is None or str(user.uuid) != str(uuid):
+        user = User.objects.filter(uuid=uuid).first()
+    return _save_info(response, user)
+
+
 def associate_by_uuid(response, user=None, *args, **kwargs):
     """Associate current auth with a user with the same uuid in the DB."""
     # pylint: disable=unused-argument,keyword-arg-before-vararg
@@ -31,10 +54,37 @@ def associate_by_uuid(response, user=None, *args, **kwargs):
             return {"user": user, "is_new": False}
 
 
-def save_info(response, *args, **kwargs):
-    """Update the user's info based on information from squarelet"""
-    # pylint: disable=unused-argument
-    user, created = squarelet_update_or_create(response["uuid"], response)
+# keys in the response which are not user data, and should not be sent to
+# the task queue
+TOKEN_KEYS = {"access_token", "id_token", "refresh_token", "token_type", "expires_in"}
+
+
+def save_info(response, user=None, *args, **kwargs):
+    """Update the user's info based on information from squarelet
+
+    The sync is skipped if this data has already been applied to the user,
+    for example by a webhook
+    """
+    # pylint: disable=unused-argument,keyword-arg-before-vararg
+    if user is not None and str(user.uuid) != str(response["uuid"]):
+        user = None
+    return _save_info(response, user)
+
+
+def _save_info(response, user):
+    """Update the user, which is None if they do not exist yet"""
+    uuid = response["uuid"]
+
+    if user is not None and user.squarelet_hash == user_data_hash(response):
+        return {"user": user, "is_new": False}
+
+    if user is not None and settings.LOGIN_DEFER_ORGANIZATIONS:
+        user, created = squarelet_update_user(uuid, response, user=user)
+        data = {k: v for k, v in response.items() if k not in TOKEN_KEYS}
+        transaction.on_commit(lambda: sync_user.delay(uuid, data))
+        return {"user": user, "is_new": created}
+
+    user, created = squarelet_update_or_create(uuid, response, user=user)
     return {"user": user, "is_new": created}
 
 
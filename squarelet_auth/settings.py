@@ -17,6 +17,64 @@ INTENT = getattr(settings, "SQUARELET_INTENT", "")
 
 RESOURCE_FIELDS = getattr(settings, "SQUARELET_RESOURCE_FIELDS", {})
 
+# HTTP client used for all requests to squarelet
+HTTP_POOL_SIZE = getattr(settings, "SQUARELET_HTTP_POOL_SIZE", 10)
+HTTP_CONNECT_TIMEOUT = getattr(settings, "SQUARELET_HTTP_CONNECT_TIMEOUT", 3.05)
+HTTP_READ_TIMEOUT = getattr(settings, "SQUARELET_HTTP_READ_TIMEOUT", 10)
+HTTP_MAX_RETRIES = getattr(settings, "SQUARELET_HTTP_MAX_RETRIES", 3)
+HTTP_RETRY_BACKOFF = getattr(settings, "SQUARELET_HTTP_RETRY_BACKOFF", 0.5)
+
+# start refreshing the access token in the background this many seconds
+# before it expires
+TOKEN_REFRESH_AHEAD = getattr(settings, "SQUARELET_TOKEN_REFRESH_AHEAD", 60)
+# stop using the access token this many seconds before it expires
+TOKEN_EXPIRY_MARGIN = getattr(settings, "SQUARELET_TOKEN_EXPIRY_MARGIN", 10)
+# the maximum number of objects pulled by a single task from the webhook
+WEBHOOK_BATCH_SIZE = getattr(settings, "SQUARELET_WEBHOOK_BATCH_SIZE", 100)
+# repeated invalidations of the same object within this many seconds are
+# collapsed into a single pull at the end of the window, 0 to disable
+WEBHOOK_DEBOUNCE = getattr(settings, "SQUARELET_WEBHOOK_DEBOUNCE", 5)
+# the number of concurrent requests to squarelet made by bulk pull tasks
+PULL_CONCURRENCY = getattr(settings, "SQUARELET_PULL_CONCURRENCY", 8)
+# the maximum number of entitlements cached in each process
+ENTITLEMENT_CACHE_SIZE = getattr(settings, "SQUARELET_ENTITLEMENT_CACHE_SIZE", 32)
+# how many seconds each entitlement is cached for, so rows changed or deleted
+# by other processes are looked up again
+ENTITLEMENT_CACHE_TIMEOUT = getattr(settings, "SQUARELET_ENTITLEMENT_CACHE_TIMEOUT", 60)
+# dotted paths to instrumentation backends, see squarelet_auth.instrumentation
+INSTRUMENTATION_BACKENDS = getattr(settings, "SQUARELET_INSTRUMENTATION_BACKENDS", [])
+# open the circuit to squarelet after this many failed requests within the
+# failure window, 0 to disable, and probe it again after the recovery timeout
+CIRCUIT_FAILURE_THRESHOLD = getattr(settings, "SQUARELET_CIRCUIT_FAILURE_THRESHOLD", 5)
+CIRCUIT_FAILURE_WINDOW = getattr(settings, "SQUARELET_CIRCUIT_FAILURE_WINDOW", 30)
+CIRCUIT_RECOVERY_TIMEOUT = getattr(settings, "SQUARELET_CIRCUIT_RECOVERY_TIMEOUT", 30)
+# how long each process may use its copy of the circuit's state before
+# reading it from the cache again
+CIRCUIT_STATE_TTL = getattr(settings, "SQUARELET_CIRCUIT_STATE_TTL", 5)
+# the maximum number of requests per second made to squarelet across all
+# processes, None to disable, and how long to wait for capacity
+RATE_LIMIT = getattr(settings, "SQUARELET_RATE_LIMIT", None)
+RATE_LIMIT_MAX_WAIT = getattr(settings, "SQUARELET_RATE_LIMIT_MAX_WAIT", 5)
+# how many requests may be made at once after the rate limit has been unused,
+# None for one second's worth
+RATE_LIMIT_BURST = getattr(settings, "SQUARELET_RATE_LIMIT_BURST", None)
+# how long to keep the OIDC discovery document and signing keys in the shared
+# cache, and how old they may get before being refreshed in the background
+OIDC_CACHE_TIMEOUT = getattr(settings, "SQUARELET_OIDC_CACHE_TIMEOUT", 24 * 60 * 60)
+OIDC_REFRESH_AGE = getattr(settings, "SQUARELET_OIDC_REFRESH_AGE", 60 * 60)
+# build the user's data from the ID token's claims when they include it,
+# instead of requesting it from the userinfo endpoint
+USE_ID_TOKEN_CLAIMS = getattr(settings, "SQUARELET_USE_ID_TOKEN_CLAIMS", False)
+# on login, only update an existing user's own fields, and sync their
+# organizations in a celery task
+LOGIN_DEFER_ORGANIZATIONS = getattr(
+    settings, "SQUARELET_LOGIN_DEFER_ORGANIZATIONS", False
+)
+# how long each user's membership index is kept in the shared cache
+MEMBERSHIP_CACHE_TIMEOUT = getattr(
+    settings, "SQUARELET_MEMBERSHIP_CACHE_TIMEOUT", 60 * 60
+)
+
 required_settings = [
     "SOCIAL_AUTH_SQUARELET_KEY",
     "SOCIAL_AUTH_SQUARELET_SECRET",
@@ -3,23 +3,37 @@
 # Django
 from celery import shared_task
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
 
 # Standard Library
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import UUID
 
 # Third Party
 import requests
 
 # SquareletAuth
 from squarelet_auth import settings
+from squarelet_auth.instrumentation import observe, phase
 from squarelet_auth.organizations import get_organization_model
 from squarelet_auth.organizations.utils import (
     squarelet_update_or_create as org_update_or_create,
 )
+from squarelet_auth.throttling import CircuitOpenError, retry_countdown
 from squarelet_auth.users.utils import (
     squarelet_update_or_create as user_update_or_create,
 )
-from squarelet_auth.utils import squarelet_get
+from squarelet_auth.utils import (
+    conditional_headers,
+    get_squarelet_access_token,
+    get_validators,
+    response_validators,
+    set_validators,
+    squarelet_get,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -30,27 +44,294 @@ Organization = get_organization_model()
 User = get_user_model()
 
 
+TYPES_URL = {"user": "users", "organization": "organizations"}
+TYPES_MODEL = {"user": User, "organization": Organization}
+TYPES_UPDATE = {"user": user_update_or_create, "organization": org_update_or_create}
+
+# errors in our own code, which should not be reported as a failed fetch
+PROGRAMMING_ERRORS = (AttributeError, NameError, TypeError)
+
+
 @shared_task(autoretry_for=(requests.exceptions.RequestException,), retry_backoff=1)
-def pull_data(type_, uuid, **kwargs):
+def pull_data(type_, uuid, timestamp=None, **kwargs):
     """Task to pull data from squarelet"""
     # pylint: disable=unused-argument
-    types_url = {"user": "users", "organization": "organizations"}
-    types_model = {"user": User, "organization": Organization}
-    types_update = {"user": user_update_or_create, "organization": org_update_or_create}
-    if type_ not in types_url:
+    if type_ not in TYPES_URL:
         logger.warning("Pull data received invalid type: %s", type_)
         return
 
-    model = types_model[type_]
-    if settings.DISABLE_CREATE and not model.objects.filter(uuid=uuid).exists():
-        # if we have disabled creating new instances from squarelet
-        # do not try to pull the data unless the instance already exists locally
+    if not _pullable_uuids(type_, [uuid]):
+        return
+
+    with phase("pull"):
+        try:
+            data, validators = _fetch_data(type_, uuid)
+        except CircuitOpenError:
+            # squarelet is down, so wait for it to recover in a new task
+            # instead of using up this task's retries
+            logger.info("Circuit open, delaying pull data for: %s %s", type_, uuid)
+            pull_data.apply_async(
+                (type_, uuid), {"timestamp": timestamp}, countdown=retry_countdown()
+            )
+            return
+        if data is None:
+            return
+        with transaction.atomic():
+            TYPES_UPDATE[type_](uuid, data)
+            _set_validators_on_commit(type_, uuid, validators)
+            _record_lag(timestamp, 1)
+
+
+@shared_task
+def pull_data_batch(type_, uuids, timestamp=None, scheduled_at=None, **kwargs):
+    """Task to pull data for a chunk of objects of a single type from squarelet
+
+    All of the data is fetched before any of it is applied, and it is then
+    applied in a single transaction.  Objects which fail to be fetched are
+    retried individually using `pull_data`.
+
+    `timestamp` is when squarelet sent the webhook, and `scheduled_at` is
+    when this task was due to start, both are used to record how stale our
+    data is.
+    """
+    # pylint: disable=unused-argument
+    start = time.time()
+    if scheduled_at is not None:
+        observe("webhook.queue_delay", start - scheduled_at)
+
+    if type_ not in TYPES_URL:
+        logger.warning("Pull data received invalid type: %s", type_)
         return
 
-    resp = squarelet_get("/api/{}/{}/".format(types_url[type_], uuid))
+    # clear the pending flags before fetching, so that any invalidations
+    # received from here on schedule a new pull
+    if settings.WEBHOOK_DEBOUNCE:
+        cache.delete_many([_pending_key(type_, uuid) for uuid in uuids])
+
+    fetched = []
+    circuit_open = []
+    items = [(type_, uuid) for uuid in _pullable_uuids(type_, uuids)]
+    for _, uuid, result in _fetch_many(items):
+        if isinstance(result, CircuitOpenError):
+            circuit_open.append(uuid)
+        elif isinstance(result, Exception):
+            logger.warning("Pull data failed for: %s %s %s", type_, uuid, result)
+            pull_data.delay(type_, uuid, timestamp=timestamp)
+        elif result[0] is not None:
+            fetched.append((type_, uuid) + result)
+    observe("webhook.fetch", time.time() - start)
+
+    if circuit_open:
+        # squarelet is down, so try these again together once it may have
+        # recovered
+        logger.info(
+            "Circuit open, delaying pull data for %d %s", len(circuit_open), type_
+        )
+        pull_data_batch.apply_async(
+            (type_, circuit_open), {"timestamp": timestamp}, countdown=retry_countdown()
+        )
+
+    with transaction.atomic():
+        failed = _apply_many(fetched)
+        _record_lag(timestamp, len(fetched) - len(failed))
+
+
+@shared_task
+def schedule_pull_data(type_, uuids, timestamp=None, **kwargs):
+    """Task to schedule pulls for the objects invalidated by a webhook
+
+    Objects which already have a pull pending are skipped, and the rest are
+    pulled in chunks once the debounce window has passed
+    """
+    # pylint: disable=unused-argument
+    uuids = debounce(type_, uuids)
+    batch_size = settings.WEBHOOK_BATCH_SIZE
+    scheduled_at = time.time() + settings.WEBHOOK_DEBOUNCE
+    for i in range(0, len(uuids), batch_size):
+        pull_data_batch.apply_async(
+            (type_, uuids[i : i + batch_size]),
+            {"timestamp": timestamp, "scheduled_at": scheduled_at},
+            countdown=settings.WEBHOOK_DEBOUNCE,
+        )
+
+
+@shared_task
+def pull_data_bulk(items, **kwargs):
+    """Task to pull data for a list of (type, uuid) pairs from squarelet
+
+    Objects are fetched concurrently and applied in order, one chunk at a
+    time.  Failures are reported per object instead of failing the task.
+    """
+    # pylint: disable=unused-argument
+    report = {"applied": 0, "skipped": 0, "not_modified": 0, "failed": []}
+
+    pullable = {}
+    for type_ in TYPES_URL:
+        uuids = [uuid for item_type, uuid in items if item_type == type_]
+        pullable[type_] = set(_pullable_uuids(type_, uuids)) if uuids else set()
+    to_pull = []
+    for type_, uuid in items:
+        if type_ not in TYPES_URL:
+            report["failed"].append((type_, uuid, "Invalid type"))
+        elif uuid in pullable[type_]:
+            to_pull.append((type_, uuid))
+        else:
+            report["skipped"] += 1
+
+    # this reuses the webhook batch size as the chunk size, so that each
+    # transaction is no larger than a webhook batch
+    batch_size = settings.WEBHOOK_BATCH_SIZE
+    for i in range(0, len(to_pull), batch_size):
+        fetched = []
+        for type_, uuid, result in _fetch_many(to_pull[i : i + batch_size]):
+            if isinstance(result, Exception):
+                logger.warning("Pull data failed for: %s %s %s", type_, uuid, result)
+                report["failed"].append((type_, uuid, repr(result)))
+            elif result[0] is None:
+                report["not_modified"] += 1
+            else:
+                fetched.append((type_, uuid) + result)
+        failed = _apply_many(fetched)
+        report["applied"] += len(fetched) - len(failed)
+        report["failed"].extend(failed)
+
+    return report
+
+
+@shared_task
+def sync_user(uuid, data, **kwargs):
+    """Task to apply user data from squarelet which was received at login"""
+    # pylint: disable=unused-argument
+    user_update_or_create(uuid, data)
+
+
+def _fetch_many(items):
+    """Fetch the data for the (type, uuid) pairs concurrently
+
+    Returns (type, uuid, result) triples in the original order, where result
+    is the (data, validators) pair from `_fetch_data`, or the exception raised
+    if the fetch failed, including failing to get an access token or decode
+    the response
+    """
+    if not items:
+        return []
+
+    def fetch(item):
+        try:
+            return _fetch_data(*item)
+        except PROGRAMMING_ERRORS:
+            raise
+        except Exception as exc:  # pylint: disable=broad-except
+            return exc
+
+    # make sure a token is available before the threads all ask for one
+    try:
+        get_squarelet_access_token()
+    except PROGRAMMING_ERRORS:
+        raise
+    except Exception as exc:  # pylint: disable=broad-except
+        return [(type_, uuid, exc) for type_, uuid in items]
+    with ThreadPoolExecutor(max_workers=settings.PULL_CONCURRENCY) as executor:
+        results = executor.map(fetch, items)
+        return [(type_, uuid, result) for (type_, uuid), result in zip(items, results)]
+
+
+def _apply_many(fetched):
+    """Apply the fetched data in order in a single transaction, returning a list
+    of the (type, uuid, error) triples for the objects which failed
+    """
+    failed = []
+    with transaction.atomic():
+        for type_, uuid, data, validators in fetched:
+            try:
+                TYPES_UPDATE[type_](uuid, data)
+                _set_validators_on_commit(type_, uuid, validators)
+            except Exception as exc:  # pylint: disable=broad-except
+                # each update is in its own savepoint, so a failure here
+                # does not affect the rest of the batch
+                logger.exception("Pull data update failed for: %s %s", type_, uuid)
+                failed.append((type_, uuid, repr(exc)))
+    return failed
+
+
+def _record_lag(timestamp, count):
+    """Once the current transaction commits, record the time since squarelet
+    sent the webhook for each object applied
+    """
+    if timestamp is None or not count:
+        return
+
+    def record():
+        lag = time.time() - int(timestamp)
+        for _ in range(count):
+            observe("webhook.lag", lag)
+
+    transaction.on_commit(record)
+
+
+def debounce(type_, uuids):
+    """Filter out the UUIDs which already have a pull pending, and mark the
+    rest as pending
+    """
+    uuids = list(dict.fromkeys(uuids))
+    if not settings.WEBHOOK_DEBOUNCE:
+        return uuids
+    keys = {uuid: _pending_key(type_, uuid) for uuid in uuids}
+    # the lock makes checking and marking the flags atomic, so only one task
+    # marks each uuid as pending.  The flags are cleared by the pull task,
+    # the timeout only guards against the task never running
+    with cache.lock(f"squarelet_auth:pull_pending_lock:{type_}"):
+        pending = cache.get_many(keys.values())
+        uuids = [uuid for uuid in uuids if keys[uuid] not in pending]
+        cache.set_many(
+            {keys[uuid]: True for uuid in uuids}, settings.WEBHOOK_DEBOUNCE + 60
+        )
+    return uuids
+
+
+def _pending_key(type_, uuid):
+    return f"squarelet_auth:pull_pending:{type_}:{uuid}"
+
+
+def _pullable_uuids(type_, uuids):
+    """Filter the UUIDs down to those we want to pull data for"""
+    if not settings.DISABLE_CREATE:
+        return uuids
+    # if we have disabled creating new instances from squarelet
+    # do not try to pull the data unless the instance already exists locally
+    # the UUIDs may be UUID objects or strings in any case, so compare them
+    # as UUIDs but return them as they were given
+    existing = set(
+        TYPES_MODEL[type_].objects.filter(uuid__in=uuids).values_list("uuid", flat=True)
+    )
+    return [uuid for uuid in uuids if UUID(str(uuid)) in existing]
+
+
+def _fetch_data(type_, uuid):
+    """Fetch the data for a single object from squarelet
+
+    The request is conditional on the validators stored from the last fetch.
+    Returns the data, or None if it has not been modified, along with the
+    new validators
+    """
+    validators = get_validators(type_, uuid)
+    resp = squarelet_get(
+        "/api/{}/{}/".format(TYPES_URL[type_], uuid),
+        headers=conditional_headers(validators),
+    )
+    if resp.status_code == 304:
+        logger.info("Pull data not modified for: %s %s", type_, uuid)
+        return None, validators
     resp.raise_for_status()
-    data = resp.json()
+    with phase("decode"):
+        data = resp.json()
     logger.info("Pull data for: %s %s %s", type_, uuid, data)
+    return data, response_validators(resp)
+
+
+def _set_validators_on_commit(type_, uuid, validators):
+    """Store the validators once the data they validate has been committed
 
-    update_or_create = types_update[type_]
-    update_or_create(uuid, data)
+    This runs after the save signals which clear the old validators
+    """
+    transaction.on_commit(lambda: set_validators(type_, uuid, validators))
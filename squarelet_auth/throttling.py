@@ -0,0 +1,214 @@
+"""Client side protection for squarelet, shared across processes through the
+Django cache
+
+The circuit breaker opens after SQUARELET_CIRCUIT_FAILURE_THRESHOLD failed
+requests within SQUARELET_CIRCUIT_FAILURE_WINDOW seconds.  While it is open
+requests fail immediately.  After SQUARELET_CIRCUIT_RECOVERY_TIMEOUT seconds
+it is half open, and a single request is let through to probe squarelet,
+closing the circuit if it succeeds and re-opening it if it fails.
+
+A successful request resets the failure count, so intermittent failures
+among successful requests do not open the circuit.
+
+Each process keeps a copy of the circuit's state for up to
+SQUARELET_CIRCUIT_STATE_TTL seconds, so a closed circuit does not cost a
+cache read on every request.
+
+The rate limiter is a token bucket refilled with SQUARELET_RATE_LIMIT tokens
+per second, holding up to SQUARELET_RATE_LIMIT_BURST tokens, which defaults to
+one second's worth.  Each request takes a token, waiting up to
+SQUARELET_RATE_LIMIT_MAX_WAIT seconds for one.
+"""
+
+# Django
+from django.core.cache import cache
+
+# Standard Library
+import logging
+import random
+import time
+
+# Third Party
+import requests
+
+# SquareletAuth
+from squarelet_auth import settings
+
+logger = logging.getLogger(__name__)
+
+OPEN_KEY = "squarelet_auth:circuit:open"
+TRIPPED_KEY = "squarelet_auth:circuit:tripped"
+PROBE_KEY = "squarelet_auth:circuit:probe"
+FAILURES_KEY = "squarelet_auth:circuit:failures"
+BUCKET_KEY = "squarelet_auth:rate_limit:bucket"
+BUCKET_LOCK_KEY = "squarelet_auth:rate_limit:lock"
+
+# (expires, keys set) of this process's copy of the circuit's state
+_circuit = (0, frozenset())
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Squarelet is failing, so the request was not made"""
+
+
+class RateLimitError(requests.exceptions.RequestException):
+    """The rate limit for squarelet was reached, so the request was not made"""
+
+
+def check_circuit():
+    """Raise an error if the circuit is open
+
+    Returns True if this request is the probe of a half open circuit
+    """
+    if not settings.CIRCUIT_FAILURE_THRESHOLD:
+        return False
+    state = _circuit_state()
+    if OPEN_KEY in state:
+        raise CircuitOpenError("Circuit to squarelet is open")
+    if TRIPPED_KEY in state:
+        # half open, only let one request through at a time
+        probe_timeout = settings.HTTP_CONNECT_TIMEOUT + settings.HTTP_READ_TIMEOUT
+        if not cache.add(PROBE_KEY, True, probe_timeout):
+            raise CircuitOpenError("Circuit to squarelet is half open")
+        return True
+    return False
+
+
+def release_probe(probe):
+    """The probe of a half open circuit was not made, so let another request
+    make it
+    """
+    if probe:
+        cache.delete(PROBE_KEY)
+
+
+def record_success(probe):
+    """A request to squarelet succeeded
+
+    A success resets the failure count, so only failures without a success
+    in between open the circuit.  The count is only reset when this process's
+    copy of the circuit's state shows there are failures, so most successes
+    do not touch the cache.
+    """
+    if probe:
+        logger.info("Closing the circuit to squarelet")
+        cache.delete_many([TRIPPED_KEY, PROBE_KEY, FAILURES_KEY])
+        _set_circuit_state([])
+    elif has_failures():
+        cache.delete(FAILURES_KEY)
+        _update_circuit_state(_circuit[1] - {FAILURES_KEY})
+
+
+def has_failures():
+    """Have failures been counted since the last success, according to this
+    process's copy of the circuit's state?
+    """
+    return FAILURES_KEY in _circuit[1]
+
+
+def record_failure(probe):
+    """A request to squarelet failed"""
+    if not settings.CIRCUIT_FAILURE_THRESHOLD:
+        return
+    if probe:
+        _open_circuit()
+        return
+    cache.add(FAILURES_KEY, 0, settings.CIRCUIT_FAILURE_WINDOW)
+    try:
+        failures = cache.incr(FAILURES_KEY)
+    except ValueError:
+        # the window expired between the add and the incr
+        cache.add(FAILURES_KEY, 1, settings.CIRCUIT_FAILURE_WINDOW)
+        failures = 1
+    if failures >= settings.CIRCUIT_FAILURE_THRESHOLD:
+        _open_circuit()
+    else:
+        _update_circuit_state(_circuit[1] | {FAILURES_KEY})
+
+
+def _open_circuit():
+    logger.warning("Opening the circuit to squarelet")
+    cache.set(OPEN_KEY, True, settings.CIRCUIT_RECOVERY_TIMEOUT)
+    # stays set until a probe succeeds, the timeout only guards against
+    # the circuit never being probed
+    cache.set(TRIPPED_KEY, True, 24 * 60 * 60)
+    cache.delete_many([PROBE_KEY, FAILURES_KEY])
+    _set_circuit_state([OPEN_KEY, TRIPPED_KEY])
+
+
+def circuit_closed():
+    """Is the circuit closed according to this process's copy of its state?
+
+    Does not read the cache, so returns False if the copy has expired
+    """
+    expires, state = _circuit
+    return time.monotonic() < expires and not state & {OPEN_KEY, TRIPPED_KEY}
+
+
+def _circuit_state():
+    """Get the keys of the circuit's state which are set, using this process's
+    copy if it has not expired
+    """
+    expires, state = _circuit
+    if time.monotonic() >= expires:
+        state = frozenset(cache.get_many([OPEN_KEY, TRIPPED_KEY, FAILURES_KEY]))
+        _set_circuit_state(state)
+    return state
+
+
+def _set_circuit_state(state):
+    global _circuit  # pylint: disable=global-statement
+    _circuit = (time.monotonic() + settings.CIRCUIT_STATE_TTL, frozenset(state))
+
+
+def _update_circuit_state(state):
+    """Change this process's copy of the circuit's state, without extending
+    how long it may be used for
+    """
+    global _circuit  # pylint: disable=global-statement
+    _circuit = (_circuit[0], frozenset(state))
+
+
+def retry_countdown():
+    """How long to wait before retrying a request which failed because the
+    circuit was open, spread out so the retries do not all arrive at once
+    """
+    recovery = settings.CIRCUIT_RECOVERY_TIMEOUT
+    return recovery + random.uniform(0, recovery)
+
+
+def rate_limit_wait():
+    """Try to take a token from the rate limiter's bucket
+
+    Returns 0 if the request may be made, otherwise the number of seconds to
+    wait before trying again
+    """
+    if not settings.RATE_LIMIT:
+        return 0
+    rate = settings.RATE_LIMIT
+    capacity = settings.RATE_LIMIT_BURST or rate
+    # the cache can not update the bucket atomically, so hold the lock while
+    # refilling it and taking a token
+    with cache.lock(BUCKET_LOCK_KEY):
+        now = time.time()
+        tokens, updated = cache.get(BUCKET_KEY) or (capacity, now)
+        tokens = min(capacity, tokens + max(now - updated, 0) * rate)
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0
+        else:
+            wait = (1 - tokens) / rate
+        # once it has been unused long enough to refill, the bucket is full
+        cache.set(BUCKET_KEY, (tokens, now), int(capacity / rate) + 1)
+    return wait
+
+
+def acquire_rate_limit():
+    """Wait for capacity from the rate limiter"""
+    deadline = time.time() + settings.RATE_LIMIT_MAX_WAIT
+    wait = rate_limit_wait()
+    while wait:
+        if time.time() + wait > deadline:
+            raise RateLimitError("Rate limit for squarelet reached")
+        time.sleep(wait)
+        wait = rate_limit_wait()
@@ -1,20 +1,73 @@
 # Django
-from django.contrib.auth.base_user import AbstractBaseUser
+from django.contrib.auth.base_user import AbstractBaseUser, BaseUserManager
 from django.contrib.auth.models import PermissionsMixin
 from django.contrib.postgres.fields import CICharField, CIEmailField
+from django.core.cache import cache
 from django.db import models, transaction
+from django.db.models import OuterRef, Prefetch
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 
 # Standard Library
+from collections import namedtuple
 from uuid import uuid4
 
 # SquareletAuth
+from squarelet_auth import settings
 from squarelet_auth.fields import AutoCreatedField, AutoLastModifiedField
 from squarelet_auth.organizations import get_organization_model
+from squarelet_auth.organizations.models import (
+    Membership,
+    get_membership_generation,
+    membership_index_key,
+    memberships_changed_in_transaction,
+    role_annotations,
+)
+from squarelet_auth.utils import clear_validators
 
 Organization = get_organization_model()
 
+# the primary keys of the organizations a user is a member and an admin of
+MembershipIndex = namedtuple("MembershipIndex", ["members", "admins"])
+
+
+def active_memberships_prefetch():
+    """Prefetch the active membership and organization into the
+    `active_memberships` attribute used by `User.organization`
+    """
+    return Prefetch(
+        "memberships",
+        queryset=Membership.objects.filter(active=True).select_related("organization"),
+        to_attr="active_memberships",
+    )
+
+
+class UserQuerySet(models.QuerySet):
+    """Custom queryset for users"""
+
+    def prefetch_active_organization(self):
+        """Load each user's active organization in a single query"""
+        return self.prefetch_related(active_memberships_prefetch())
+
+    def select_active_organization(self):
+        """Load each user's active organization in the same query, using the
+        `active_organization` pointer
+        """
+        return self.select_related("active_organization")
+
+    def annotate_roles(self, organization):
+        """Annotate whether each user is a member and an admin of the
+        organization, and whether it is their active organization
+        """
+        memberships = Membership.objects.filter(
+            user=OuterRef("pk"), organization=organization
+        )
+        return self.annotate(**role_annotations(memberships))
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
+    """Custom manager for users"""
+
 
 class User(AbstractBaseUser, PermissionsMixin):
 
@@ -83,6 +136,45 @@ class User(AbstractBaseUser, PermissionsMixin):
     updated_at = AutoLastModifiedField(
         _("updated at"), help_text=_("Timestamp of when the user was last updated")
     )
+    squarelet_synced_at = models.DateTimeField(
+        _("squarelet synced at"),
+        null=True,
+        blank=True,
+        editable=False,
+        help_text=_("Timestamp of when changed data from squarelet was last applied"),
+    )
+    squarelet_hash = models.CharField(
+        _("squarelet hash"),
+        max_length=64,
+        blank=True,
+        editable=False,
+        help_text=_("A hash of the data from squarelet which was last applied"),
+    )
+
+    active_organization = models.ForeignKey(
+        verbose_name=_("active organization"),
+        to=settings.ORGANIZATION_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="+",
+        help_text=_(
+            "The organization of the user's active membership, kept in sync "
+            "with the memberships to avoid a join"
+        ),
+    )
+
+    is_verified_journalist = models.BooleanField(
+        _("verified journalist"),
+        null=True,
+        default=None,
+        editable=False,
+        help_text=_(
+            "Is this user a member of a verified journalistic organization?  "
+            "Kept in sync with their organizations, unknown until first synced"
+        ),
+    )
 
     # preferences
     use_autologin = models.BooleanField(
@@ -94,6 +186,8 @@ class User(AbstractBaseUser, PermissionsMixin):
         ),
     )
 
+    objects = UserManager()
+
     USERNAME_FIELD = "username"
     EMAIL_FIELD = "email"
     REQUIRED_FIELDS = ["email"]
@@ -119,10 +213,20 @@ class User(AbstractBaseUser, PermissionsMixin):
     @property
     def organization(self):
         """Get the user's active organization"""
-        # first check the prefetch cache, for performance reasons
+        # first check for an already loaded organization, for performance
+        # reasons
+        pointer = type(self).active_organization
+        if self.active_organization_id is not None and pointer.is_cached(self):
+            return self.active_organization
+
         if hasattr(self, "active_memberships"):
+            if not self.active_memberships:
+                raise Membership.DoesNotExist("The user has no active membership")
             return self.active_memberships[0].organization
 
+        if self.active_organization_id is not None:
+            return self.active_organization
+
         return (
             self.memberships.select_related("organization")
             .get(active=True)
@@ -140,6 +244,12 @@ class User(AbstractBaseUser, PermissionsMixin):
         with transaction.atomic():
             self.memberships.filter(active=True).update(active=False)
             self.memberships.filter(organization=organization).update(active=True)
+            type(self)._default_manager.filter(pk=self.pk).update(
+                active_organization=organization
+            )
+        self.active_organization = organization
+        self.__dict__.pop("active_memberships", None)
+        clear_validators("user", self.uuid)
 
     @property
     def individual_organization(self):
@@ -152,4 +262,41 @@ class User(AbstractBaseUser, PermissionsMixin):
     @property
     def verified_journalist(self):
         """Is this user a member of a verified journalistic organization?"""
+        if self.is_verified_journalist is not None:
+            return self.is_verified_journalist
         return self.organizations.filter(verified_journalist=True).exists()
+
+    @property
+    def membership_index(self):
+        """Get the user's membership index
+
+        It is cached on the instance and in the shared cache, under a
+        generation which is replaced when a change to the user's memberships
+        is committed.  Inside a transaction which has changed them, it is
+        always read from the database.
+        """
+        if memberships_changed_in_transaction(self.pk):
+            return self._build_membership_index()
+        index = self.__dict__.get("_membership_index")
+        if index is None:
+            # read the generation before the memberships, so an index built
+            # from data which has since changed is cached under an old one
+            generation = get_membership_generation(self.pk)
+            key = membership_index_key(self.pk, generation)
+            index = cache.get(key)
+            if index is None:
+                index = self._build_membership_index()
+                cache.add(key, index, settings.MEMBERSHIP_CACHE_TIMEOUT)
+            self.__dict__["_membership_index"] = index
+        return index
+
+    def _build_membership_index(self):
+        members = set()
+        admins = set()
+        for organization_id, admin in self.memberships.values_list(
+            "organization_id", "admin"
+        ):
+            members.add(organization_id)
+            if admin:
+                admins.add(organization_id)
+        return MembershipIndex(frozenset(members), frozenset(admins))
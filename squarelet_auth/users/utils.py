@@ -2,80 +2,308 @@
 import django.dispatch
 from django.contrib.auth import get_user_model
 from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, prefetch_related_objects
+from django.utils import timezone
 
 # Standard Library
 import logging
+from itertools import chain
+from uuid import UUID
 
 # SquareletAuth
 from squarelet_auth import settings
+from squarelet_auth.instrumentation import phase
 from squarelet_auth.organizations import get_organization_model
-from squarelet_auth.organizations.models import Membership
+from squarelet_auth.organizations.models import (
+    Membership,
+    memberships_changed,
+    syncing_memberships,
+)
 from squarelet_auth.organizations.utils import (
+    squarelet_bulk_update_or_create as organization_bulk_update_or_create,
     squarelet_update_or_create as organization_update_or_create,
 )
+from squarelet_auth.users.models import active_memberships_prefetch
+from squarelet_auth.utils import clear_validators, payload_hash
 
 User = get_user_model()
 Organization = get_organization_model()
 
 logger = logging.getLogger(__name__)
 
+USER_MAP = {
+    "preferred_username": "username",
+    "email": "email",
+    "name": "name",
+    "picture": "avatar_url",
+    "email_failed": "email_failed",
+    "email_verified": "email_verified",
+    "use_autologin": "use_autologin",
+    "bio": "bio",
+}
+# the user fields which are set from squarelet data
+SYNCED_FIELDS = frozenset(USER_MAP.values())
+USER_DEFAULTS = {
+    "preferred_username": "",
+    "email": "",
+    "name": "",
+    "picture": "",
+    "email_failed": False,
+    "email_verified": False,
+    "use_autologin": True,
+    "bio": "",
+}
+
 user_update = django.dispatch.Signal()
 
 
 @transaction.atomic
-def squarelet_update_or_create(uuid, data):
-    """Update or create users based on data from squarelet"""
+def squarelet_update_or_create(uuid, data, user=None):
+    """Update or create users based on data from squarelet
 
-    required_fields = {"preferred_username", "organizations"}
-    missing = required_fields - (required_fields & set(data.keys()))
-    if missing:
-        raise ValueError(f"Missing required fields: {missing}")
+    `user` may be passed if it has already been loaded, to avoid looking it
+    up again
+    """
+
+    _check_data(data)
 
     if data.get("is_agency") and settings.DISABLE_CREATE_AGENCY:
         # do not create agency users if they have been disabled
         return None, False
 
-    user, created = _squarelet_update_or_create(uuid, data)
+    with phase("user"):
+        user, created = _squarelet_update_or_create(uuid, data, user=user)
 
-    _update_organizations(user, data)
+    with phase("organizations"):
+        _update_organizations(user, data)
 
-    user_update.send(sender=User, user=user, data=data)
+    with phase("user_update"):
+        user_update.send(sender=User, user=user, data=data)
 
     return user, created
 
 
-def _squarelet_update_or_create(uuid, data):
-    """Format user data and update or create the user"""
-    user_map = {
-        "preferred_username": "username",
-        "email": "email",
-        "name": "name",
-        "picture": "avatar_url",
-        "email_failed": "email_failed",
-        "email_verified": "email_verified",
-        "use_autologin": "use_autologin",
-        "bio": "bio",
-    }
-    user_defaults = {
-        "preferred_username": "",
-        "email": "",
-        "name": "",
-        "picture": "",
-        "email_failed": False,
-        "email_verified": False,
-        "use_autologin": True,
-        "bio": "",
-    }
-    user_data = {user_map[k]: data.get(k, user_defaults[k]) for k in user_map}
-    return User.objects.update_or_create(uuid=uuid, defaults=user_data)
+@transaction.atomic
+def squarelet_update_user(uuid, data, user=None):
+    """Update or create only the user from data from squarelet, leaving their
+    organizations to be synced by `squarelet_update_or_create`
+    """
+
+    _check_data(data)
+
+    if data.get("is_agency") and settings.DISABLE_CREATE_AGENCY:
+        return None, False
+
+    with phase("user"):
+        return _squarelet_update_or_create(uuid, data, store_hash=False, user=user)
+
+
+@transaction.atomic
+def squarelet_bulk_update_or_create(data_list):
+    """Update or create many users and their organizations based on data
+    from squarelet, using a constant number of queries
+
+    Returns a list of the users which were updated or created
+    """
+    data_by_uuid = {}
+    for data in data_list:
+        _check_data(data)
+        if data.get("is_agency") and settings.DISABLE_CREATE_AGENCY:
+            # do not create agency users if they have been disabled
+            continue
+        data_by_uuid[UUID(str(data["uuid"]))] = data
+
+    users = _bulk_save_users(data_by_uuid)
+    organizations = organization_bulk_update_or_create(
+        org_data for data in data_by_uuid.values() for org_data in data["organizations"]
+    )
+    user_memberships = _bulk_save_memberships(data_by_uuid, users, organizations)
+    _bulk_save_membership_fields(users, user_memberships)
+
+    for uuid, data in data_by_uuid.items():
+        user_update.send(sender=User, user=users[uuid], data=data)
+
+    return list(users.values())
+
+
+def _bulk_save_users(data_by_uuid):
+    """Create or update the users in the data keyed by UUID, returning all of
+    them keyed by UUID
+    """
+    users = User.objects.in_bulk(data_by_uuid.keys(), field_name="uuid")
+    new_users = []
+    changed_users = []
+    update_fields = set()
+    for uuid, data in data_by_uuid.items():
+        user_data = _user_data(data)
+        user_data["squarelet_hash"] = user_data_hash(data)
+        user = users.get(uuid)
+        if user is None:
+            user = User(uuid=uuid, squarelet_synced_at=timezone.now(), **user_data)
+            new_users.append(user)
+            users[uuid] = user
+        else:
+            changed_fields = _set_changed_fields(user, user_data)
+            if changed_fields:
+                user.updated_at = user.squarelet_synced_at = timezone.now()
+                changed_users.append(user)
+                update_fields.update(changed_fields)
+    if new_users:
+        User.objects.bulk_create(new_users)
+    if changed_users:
+        User.objects.bulk_update(
+            changed_users, update_fields | {"updated_at", "squarelet_synced_at"}
+        )
+    return users
+
+
+def _bulk_save_memberships(data_by_uuid, users, organizations):
+    """Reconcile the memberships of the users against the data keyed by UUID
+    and save the changes
+
+    Returns all of the memberships each user will have, keyed by their UUID
+    """
+    current_memberships = {user.pk: {} for user in users.values()}
+    for membership in Membership.objects.filter(user__in=users.values()).select_related(
+        "organization"
+    ):
+        current_memberships[membership.user_id][
+            membership.organization.uuid
+        ] = membership
+    new_memberships = []
+    changed_memberships = {}
+    removed_memberships = []
+    user_memberships = {}
+    for uuid, data in data_by_uuid.items():
+        organizations_admin = [
+            (organizations[UUID(str(org_data["uuid"]))], org_data["admin"])
+            for org_data in sorted(data["organizations"], key=lambda x: x["individual"])
+        ]
+        new, changed, removed, user_memberships[uuid] = _reconcile_memberships(
+            users[uuid], current_memberships[users[uuid].pk], organizations_admin
+        )
+        new_memberships.extend(new)
+        changed_memberships.update(changed)
+        removed_memberships.extend(removed)
+    _save_memberships(new_memberships, changed_memberships, removed_memberships)
+    return user_memberships
+
+
+def _bulk_save_membership_fields(users, user_memberships):
+    """Save the users' fields which are derived from their memberships, for
+    those which have changed
+    """
+    changed_users = []
+    update_fields = set()
+    for uuid, memberships in user_memberships.items():
+        changed_fields = _set_membership_fields(users[uuid], memberships)
+        if changed_fields:
+            changed_users.append(users[uuid])
+            update_fields.update(changed_fields)
+    if changed_users:
+        User.objects.bulk_update(changed_users, update_fields)
+
+
+def prefetch_active_organization(*users):
+    """Load the active organizations of already fetched users, for
+    `User.organization`
+
+    Users with an active organization pointer have it loaded, and only the
+    users without one have their active membership prefetched.  Anonymous
+    users and users which already have them loaded are skipped.
+    """
+    users = [user for user in users if user.pk is not None]
+    pointed = [user for user in users if user.active_organization_id is not None]
+    unpointed = [
+        user
+        for user in users
+        if user.active_organization_id is None
+        and not hasattr(user, "active_memberships")
+    ]
+    if pointed:
+        prefetch_related_objects(pointed, "active_organization")
+    if unpointed:
+        prefetch_related_objects(unpointed, active_memberships_prefetch())
+
+
+def clear_user_validators(instance, update_fields=None, **kwargs):
+    """Receiver to clear the validators of a changed user
+
+    Saves of only fields which are not synced from squarelet, such as the
+    last login time, are ignored
+    """
+    # pylint: disable=unused-argument
+    if update_fields is not None and not SYNCED_FIELDS.intersection(update_fields):
+        return
+    clear_validators("user", instance.uuid)
+
+
+def _check_data(data):
+    required_fields = {"preferred_username", "organizations"}
+    missing = required_fields - (required_fields & set(data.keys()))
+    if missing:
+        raise ValueError(f"Missing required fields: {missing}")
+
+
+def _user_data(data):
+    """Format user data from squarelet into user model fields"""
+    return {USER_MAP[k]: data.get(k, USER_DEFAULTS[k]) for k in USER_MAP}
+
+
+def user_data_hash(data):
+    """Hash the parts of the user data from squarelet which are applied, so
+    unchanged data can be detected without comparing the user and their
+    organizations
+    """
+    applied = {k: data.get(k, USER_DEFAULTS[k]) for k in USER_MAP}
+    applied["organizations"] = sorted(
+        data["organizations"], key=lambda x: str(x["uuid"])
+    )
+    return payload_hash(applied)
+
+
+def _set_changed_fields(user, user_data):
+    """Set the fields which have changed on the user, returning their names"""
+    update_fields = [
+        field for field, value in user_data.items() if getattr(user, field) != value
+    ]
+    for field in update_fields:
+        setattr(user, field, user_data[field])
+    return update_fields
+
+
+def _squarelet_update_or_create(uuid, data, store_hash=True, user=None):
+    """Format user data and update or create the user
+
+    The hash of the data is only stored if the organizations are also being
+    synced
+    """
+    user_data = _user_data(data)
+    if store_hash:
+        user_data["squarelet_hash"] = user_data_hash(data)
+
+    if user is None:
+        user = User.objects.filter(uuid=uuid).first()
+    if user is None:
+        user_data["squarelet_synced_at"] = timezone.now()
+        return User.objects.update_or_create(uuid=uuid, defaults=user_data)
+
+    # only write the fields which have changed, if any
+    update_fields = _set_changed_fields(user, user_data)
+    if update_fields:
+        user.squarelet_synced_at = timezone.now()
+        user.save(update_fields=update_fields + ["updated_at", "squarelet_synced_at"])
+    return user, False
 
 
 def _update_organizations(user, data):
-    """Update the user's organizations"""
+    """Update the user's organizations
+
+    The user's memberships are loaded once and reconciled against the data
+    from squarelet in memory, then saved with a constant number of queries
+    """
     logger.info("[SQ AUTH] Updating organizations for %s", user.username)
-    current_organizations = set(user.organizations.all())
-    new_memberships = []
-    active = True
+    current_memberships = {m.organization.uuid: m for m in _memberships(user)}
 
     # process each organization
     organizations = data.get("organizations", [])
@@ -85,46 +313,185 @@ def _update_organizations(user, data):
         user.username,
         ", ".join(o["name"] for o in organizations),
     )
+    organizations_admin = []
     for org_data in organizations:
         logger.info("[SQ AUTH] Org data: %s", org_data)
+        membership = current_memberships.get(UUID(str(org_data["uuid"])))
         organization, _ = organization_update_or_create(
-            uuid=org_data["uuid"], data=org_data
+            uuid=org_data["uuid"],
+            data=org_data,
+            organization=membership.organization if membership else None,
         )
-        if organization in current_organizations:
-            # remove organizations from our set as we see them
-            # any that are left will need to be removed
-            current_organizations.remove(organization)
-            user.memberships.filter(organization=organization).update(
-                admin=org_data["admin"]
-            )
+        organizations_admin.append((organization, org_data["admin"]))
+
+    new, changed, removed, memberships = _reconcile_memberships(
+        user, current_memberships, organizations_admin
+    )
+    _save_memberships(new, changed, removed)
+    _clear_membership_cache(user)
+    changed_fields = _set_membership_fields(user, memberships)
+    if changed_fields:
+        User.objects.filter(pk=user.pk).update(
+            **{field: getattr(user, field) for field in changed_fields}
+        )
+
+
+def _memberships(user):
+    """Get the user's memberships with their organizations, using the prefetch
+    cache if it has been populated
+    """
+    if "memberships" in getattr(user, "_prefetched_objects_cache", {}):
+        return user.memberships.all()
+    return user.memberships.select_related("organization")
+
+
+def _clear_membership_cache(user):
+    """Clear any memberships cached on the user, which are now out of date"""
+    # pylint: disable=protected-access
+    getattr(user, "_prefetched_objects_cache", {}).pop("memberships", None)
+    user.__dict__.pop("active_memberships", None)
+    user.__dict__.pop("_membership_index", None)
+
+
+def _reconcile_memberships(user, current_memberships, organizations_admin):
+    """Compute the changes needed to the user's memberships
+
+    `current_memberships` are the user's memberships keyed by organization
+    UUID, and `organizations_admin` is a list of (organization, admin) pairs
+    the user should be a member of, in order of preference for activation.
+
+    Returns the new memberships, the changed memberships keyed by primary key,
+    the memberships to remove and all of the memberships the user will have
+    """
+    current_memberships = dict(current_memberships)
+    memberships = []
+    new_memberships = []
+    changed_memberships = {}
+
+    for organization, admin in organizations_admin:
+        # remove memberships from our dict as we see them
+        # any that are left will need to be removed
+        membership = current_memberships.pop(UUID(str(organization.uuid)), None)
+        if membership is not None:
+            membership.organization = organization
+            if membership.admin != admin:
+                membership.admin = admin
+                changed_memberships[membership.pk] = membership
+            memberships.append(membership)
         else:
             # if not currently a member, create the new membership
-            # automatically activate new organizations (only first one)
             new_memberships.append(
                 Membership(
-                    user=user,
-                    organization=organization,
-                    active=active,
-                    admin=org_data["admin"],
+                    user=user, organization=organization, active=False, admin=admin
                 )
             )
-            active = False
 
+    # never remove the user's individual organization
+    removed_memberships = []
+    for membership in current_memberships.values():
+        if membership.organization.individual:
+            logger.error("Trying to remove a user's individual organization: %s", user)
+            memberships.append(membership)
+        else:
+            removed_memberships.append(membership)
+
+    changed_memberships.update(
+        (membership.pk, membership)
+        for membership in _update_active_membership(user, new_memberships, memberships)
+    )
+
+    return (
+        new_memberships,
+        changed_memberships,
+        removed_memberships,
+        new_memberships + memberships,
+    )
+
+
+def _update_active_membership(user, new_memberships, memberships):
+    """Set which of the user's memberships is active, returning the existing
+    memberships which were changed
+    """
+    changed = []
     if new_memberships:
-        # first new membership will be made active, de-activate current
-        # active org first
-        user.memberships.filter(active=True).update(active=False)
-        user.memberships.bulk_create(new_memberships)
+        # automatically activate new organizations (only first one)
+        # de-activate current active org
+        new_memberships[0].active = True
+        for membership in memberships:
+            if membership.active:
+                membership.active = False
+                changed.append(membership)
+    elif not any(m.active for m in memberships):
+        # user must have an active organization, if the current
+        # active one is removed, we will activate the user's individual
+        # organization
+        for membership in memberships:
+            if membership.organization.individual:
+                membership.active = True
+                changed.append(membership)
+                break
+        else:
+            logger.error("User has no individual organization to activate: %s", user)
+    return changed
 
-    # user must have an active organization, if the current
-    # active one is removed, we will activate the user's individual organization
-    if user.organization in current_organizations:
-        user.memberships.filter(organization__individual=True).update(active=True)
 
-    # never remove the user's individual organization
-    individual_organization = user.memberships.get(organization__individual=True)
-    if individual_organization in current_organizations:
-        logger.error("Trying to remove a user's individual organization: %s", user)
-        current_organizations.remove(individual_organization)
+def _set_membership_fields(user, memberships):
+    """Set the user's fields which are derived from their memberships,
+    returning the names of those which changed and need to be saved
+    """
+    changed_fields = []
+
+    active_organization = next((m.organization for m in memberships if m.active), None)
+    organization_id = active_organization.pk if active_organization else None
+    if user.active_organization_id != organization_id:
+        user.active_organization = active_organization
+        changed_fields.append("active_organization")
+
+    verified_journalist = any(m.organization.verified_journalist for m in memberships)
+    if user.is_verified_journalist != verified_journalist:
+        user.is_verified_journalist = verified_journalist
+        changed_fields.append("is_verified_journalist")
+
+    return changed_fields
+
+
+def repair_active_organizations(dry_run=False):
+    """Fix users whose active organization pointer does not match their
+    active membership
 
-    user.memberships.filter(organization__in=current_organizations).delete()
+    Returns the number of users which were out of sync
+    """
+    active = Membership.objects.filter(user=OuterRef("pk"), active=True).values(
+        "organization_id"
+    )[:1]
+    drifted = [
+        User(pk=pk, active_organization_id=expected)
+        for pk, current, expected in User.objects.annotate(expected=Subquery(active))
+        .exclude(active_organization_id=F("expected"))
+        .values_list("pk", "active_organization_id", "expected")
+        .iterator()
+        if current != expected
+    ]
+    if drifted and not dry_run:
+        User.objects.bulk_update(drifted, ["active_organization"], batch_size=1000)
+    return len(drifted)
+
+
+def _save_memberships(new_memberships, changed_memberships, removed_memberships):
+    """Save the membership changes with bulk queries"""
+    memberships = chain(
+        new_memberships, changed_memberships.values(), removed_memberships
+    )
+    memberships_changed(m.user_id for m in memberships)
+    if changed_memberships:
+        Membership.objects.bulk_update(
+            changed_memberships.values(), ["admin", "active"]
+        )
+    if new_memberships:
+        Membership.objects.bulk_create(new_memberships)
+    if removed_memberships:
+        # the users' derived fields and indexes are updated by the sync
+        with syncing_memberships():
+            Membership.objects.filter(
+                pk__in=[m.pk for m in removed_memberships]
+            ).delete()
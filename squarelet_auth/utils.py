@@ -2,63 +2,329 @@
 from django.core.cache import cache
 
 # Standard Library
+import hashlib
+import json
 import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+from uuid import UUID
 
 # Third Party
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # SquareletAuth
 from squarelet_auth import settings
+from squarelet_auth.instrumentation import phase
+from squarelet_auth.throttling import (
+    RateLimitError,
+    acquire_rate_limit,
+    check_circuit,
+    record_failure,
+    record_success,
+    release_probe,
+)
 
 logger = logging.getLogger(__name__)
 
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+ACCESS_TOKEN_CACHE_KEY = "squarelet_auth:access_token"
+# (access token, expires at) held in process memory
+_token = None
+
+# how long to remember ETag and Last-Modified values for objects
+VALIDATORS_TIMEOUT = 7 * 24 * 60 * 60
+
+# (pid, names of the running background threads, lock) for this process
+_background = None
+
+
+def get_squarelet_session():
+    """Get the connection pooled session used to talk to squarelet
+
+    One session is shared by all threads in a process.  It is re-created
+    after a fork, so that worker processes do not share sockets with their
+    parent.
+    """
+    global _session, _session_pid  # pylint: disable=global-statement
+
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                _session = _create_session()
+                _session_pid = pid
+    return _session
+
+
+def _create_session():
+    """Create a session with a pooled, retrying transport adapter"""
+    # only retry failures to connect and gateway errors, retrying read
+    # timeouts would multiply the read timeout by the number of attempts
+    retry = Retry(
+        total=settings.HTTP_MAX_RETRIES,
+        connect=settings.HTTP_MAX_RETRIES,
+        read=False,
+        status=settings.HTTP_MAX_RETRIES,
+        backoff_factor=settings.HTTP_RETRY_BACKOFF,
+        status_forcelist=(502, 503, 504),
+        # let the caller decide what to do with the final error response
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=settings.HTTP_POOL_SIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(
+        {
+            "Accept-Encoding": "gzip, deflate",
+            "X-Bypass-Rate-Limit": settings.BYPASS_RATE_LIMIT_SECRET,
+        }
+    )
+    return session
+
+
+def _request(method, url, **kwargs):
+    """Make a request to squarelet using the shared session, subject to the
+    rate limiter and circuit breaker
+    """
+    kwargs.setdefault(
+        "timeout", (settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_READ_TIMEOUT)
+    )
+    # check the circuit first, so requests fail fast while it is open
+    probe = check_circuit()
+    try:
+        acquire_rate_limit()
+    except RateLimitError:
+        release_probe(probe)
+        raise
+    try:
+        resp = get_squarelet_session().request(method, url, **kwargs)
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+        record_failure(probe)
+        raise
+    if resp.status_code >= 500:
+        record_failure(probe)
+    else:
+        record_success(probe)
+    return resp
+
+
+def _background_registry():
+    """Get this process's registry of running background threads
+
+    It is replaced after a fork, as the child does not inherit the parent's
+    threads, and may inherit its lock in a locked state
+    """
+    global _background  # pylint: disable=global-statement
+
+    registry = _background
+    pid = os.getpid()
+    if registry is None or registry[0] != pid:
+        registry = _background = (pid, set(), threading.Lock())
+    return registry
+
+
+def run_in_background(name, func):
+    """Run `func` in a daemon thread, unless a thread started under the same
+    name is still running in this process
+    """
+    _pid, running, lock = _background_registry()
+    with lock:
+        if name in running:
+            return
+        running.add(name)
+
+    def target():
+        try:
+            func()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Background task %s failed", name)
+        finally:
+            with lock:
+                running.discard(name)
+
+    threading.Thread(target=target, name=f"squarelet-{name}", daemon=True).start()
+
 
 def get_squarelet_access_token():
-    """Get an access token for squarelet"""
-
-    # if not in cache, lock, acquire token, put in cache
-    access_token = cache.get("squarelet_access_token")
-    if access_token is None:
-        with cache.lock("squarelet_access_token"):
-            access_token = cache.get("squarelet_access_token")
-            if access_token is None:
-                token_url = f"{settings.SQUARELET_URL}/openid/token"
-                auth = (
-                    settings.SOCIAL_AUTH_SQUARELET_KEY,
-                    settings.SOCIAL_AUTH_SQUARELET_SECRET,
-                )
-                data = {"grant_type": "client_credentials"}
-                headers = {"X-Bypass-Rate-Limit": settings.BYPASS_RATE_LIMIT_SECRET}
-                logger.info(token_url)
-                resp = requests.post(token_url, data=data, auth=auth, headers=headers)
-                resp.raise_for_status()
-                resp_json = resp.json()
-                access_token = resp_json["access_token"]
-                # expire a few seconds early to ensure its not expired
-                # when we try to use it
-                expires_in = int(resp_json["expires_in"]) - 10
-                cache.set("squarelet_access_token", access_token, expires_in)
-    return access_token
-
-
-def _squarelet(method, path, **kwargs):
+    """Get an access token for squarelet
+
+    Tokens are kept in process memory in front of the shared cache.  Once a
+    token gets close to expiring it is refreshed in the background while the
+    current token keeps being served, so callers only block when there is no
+    usable token at all.
+    """
+    token = _token
+    if _is_fresh(token, settings.TOKEN_REFRESH_AHEAD):
+        return token[0]
+    if _is_fresh(token, settings.TOKEN_EXPIRY_MARGIN):
+        run_in_background(
+            "access-token", lambda: _load_access_token(settings.TOKEN_REFRESH_AHEAD)
+        )
+        return token[0]
+    return _load_access_token(settings.TOKEN_EXPIRY_MARGIN)[0]
+
+
+def _is_fresh(token, margin):
+    """Is the token valid for at least `margin` more seconds?"""
+    return token is not None and time.time() < token[1] - margin
+
+
+def _set_local_token(token):
+    global _token  # pylint: disable=global-statement
+    _token = token
+
+
+def _load_access_token(margin):
+    """Load a token from the shared cache, requesting a new one from squarelet
+    if the cached one is not valid for at least `margin` more seconds
+    """
+    token = cache.get(ACCESS_TOKEN_CACHE_KEY)
+    if not _is_fresh(token, margin):
+        with cache.lock(ACCESS_TOKEN_CACHE_KEY):
+            token = cache.get(ACCESS_TOKEN_CACHE_KEY)
+            if not _is_fresh(token, margin):
+                token = _request_access_token()
+                _cache_access_token(token)
+    _set_local_token(token)
+    return token
+
+
+def _cache_access_token(token):
+    """Store the token in the shared cache"""
+    # expire from the cache a few seconds early to ensure its
+    # not expired when we try to use it
+    timeout = int(token[1] - time.time()) - settings.TOKEN_EXPIRY_MARGIN
+    cache.set(ACCESS_TOKEN_CACHE_KEY, token, max(timeout, 1))
+
+
+def _access_token_request():
+    """The URL and keyword arguments used to request a new access token"""
+    token_url = f"{settings.SQUARELET_URL}/openid/token"
+    auth = (settings.SOCIAL_AUTH_SQUARELET_KEY, settings.SOCIAL_AUTH_SQUARELET_SECRET)
+    data = {"grant_type": "client_credentials"}
+    return token_url, {"data": data, "auth": auth}
+
+
+def _parse_access_token(resp_json):
+    """Convert a token response into an (access token, expires at) pair"""
+    return (resp_json["access_token"], time.time() + int(resp_json["expires_in"]))
+
+
+def _request_access_token():
+    """Request a new access token from squarelet"""
+    token_url, kwargs = _access_token_request()
+    logger.info(token_url)
+    resp = _request("POST", token_url, **kwargs)
+    resp.raise_for_status()
+    return _parse_access_token(resp.json())
+
+
+def _squarelet(method, path, headers=None, **kwargs):
     """Helper function for squarelet requests"""
     api_url = f"{settings.SQUARELET_URL}{path}"
-    access_token = get_squarelet_access_token()
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "X-Bypass-Rate-Limit": settings.BYPASS_RATE_LIMIT_SECRET,
-    }
-    return method(api_url, headers=headers, **kwargs)
+    with phase("token"):
+        access_token = get_squarelet_access_token()
+    headers = dict(headers or {}, Authorization=f"Bearer {access_token}")
+    with phase("http"):
+        return _request(method, api_url, headers=headers, **kwargs)
 
 
 def squarelet_post(path, data):
     """Make a post request to squarlet"""
-    return _squarelet(requests.post, path, data=data)
+    return _squarelet("POST", path, data=data)
 
 
-def squarelet_get(path, params=None):
+def squarelet_get(path, params=None, headers=None):
     """Make a get request to squarlet"""
     if params is None:
         params = {}
-    return _squarelet(requests.get, path, params=params)
+    return _squarelet("GET", path, params=params, headers=headers)
+
+
+def get_validators(type_, uuid):
+    """Get the stored cache validators for an object from squarelet"""
+    return cache.get(_validators_key(type_, uuid))
+
+
+def set_validators(type_, uuid, validators):
+    """Store the cache validators for an object from squarelet"""
+    if validators:
+        cache.set(_validators_key(type_, uuid), validators, VALIDATORS_TIMEOUT)
+
+
+def clear_validators(type_, uuid):
+    """Clear the stored cache validators for an object, so the next request
+    for it fetches the full data
+    """
+    cache.delete(_validators_key(type_, uuid))
+
+
+def _validators_key(type_, uuid):
+    return f"squarelet_auth:validators:{type_}:{UUID(str(uuid))}"
+
+
+def response_validators(resp):
+    """Get the cache validators from a response"""
+    validators = {}
+    if "ETag" in resp.headers:
+        validators["etag"] = resp.headers["ETag"]
+    if "Last-Modified" in resp.headers:
+        validators["last_modified"] = resp.headers["Last-Modified"]
+    return validators
+
+
+def conditional_headers(validators):
+    """Get the headers to make a request conditional on the validators"""
+    headers = {}
+    if validators and "etag" in validators:
+        headers["If-None-Match"] = validators["etag"]
+    if validators and "last_modified" in validators:
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+
+def clear_organization_validators(instance, **kwargs):
+    """Receiver to clear the validators of a changed organization"""
+    # pylint: disable=unused-argument
+    clear_validators("organization", instance.uuid)
+
+
+def squarelet_get_pages(path, params=None):
+    """Iterate over a paginated squarelet listing one page at a time
+
+    Yields the results of each page along with the path of the following
+    page, which may be passed back in to resume the listing from there
+    """
+    while path:
+        resp = squarelet_get(path, params)
+        resp.raise_for_status()
+        resp_json = resp.json()
+        next_url = resp_json.get("next")
+        if next_url:
+            # the next page's query string includes the original parameters
+            next_url = urlsplit(next_url)
+            path = f"{next_url.path}?{next_url.query}"
+            params = None
+        else:
+            path = None
+        yield resp_json["results"], path
+
+
+def payload_hash(data, exclude=()):
+    """A stable fingerprint of a payload from squarelet"""
+    data = {k: v for k, v in data.items() if k not in exclude}
+    return hashlib.sha256(
+        json.dumps(data, sort_keys=True, default=str).encode("utf8")
+    ).hexdigest()
@@ -16,7 +16,7 @@ from urllib.parse import urlencode
 
 # SquareletAuth
 from squarelet_auth import settings
-from squarelet_auth.tasks import pull_data
+from squarelet_auth.tasks import schedule_pull_data
 
 logger = logging.getLogger(__name__)
 
@@ -44,9 +44,9 @@ def webhook(request):
     if not match or not timestamp_current:
         return HttpResponseForbidden()
 
-    # pull the new data asynchrnously
-    for uuid in uuids:
-        pull_data.delay(type_, uuid)
+    # pull the new data asynchrnously, the task skips any objects which
+    # already have a pull pending and pulls the rest in chunks
+    schedule_pull_data.delay(type_, uuids, timestamp=timestamp)
     return HttpResponse("OK")
 
 
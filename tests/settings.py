@@ -0,0 +1,64 @@
+"""Django settings for the tests
+
+The tests use the benchmark app's concrete user model and need a PostgreSQL
+server.  Connection details are read from the same environment variables as
+the benchmarks.
+
+    DJANGO_SETTINGS_MODULE=tests.settings python -m django test tests
+"""
+
+# Standard Library
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BASE_DIR, "benchmarks"))
+
+SECRET_KEY = "tests"
+INSTALLED_APPS = [
+    "django.contrib.admin",
+    "django.contrib.contenttypes",
+    "django.contrib.auth",
+    "django.contrib.messages",
+    "django.contrib.sessions",
+    "squarelet_auth",
+    "squarelet_auth.organizations.apps.OrganizationsConfig",
+    "benchapp",
+]
+MIDDLEWARE = [
+    "django.contrib.sessions.middleware.SessionMiddleware",
+    "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "django.contrib.messages.middleware.MessageMiddleware",
+]
+TEMPLATES = [
+    {
+        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "APP_DIRS": True,
+        "OPTIONS": {
+            "context_processors": [
+                "django.template.context_processors.request",
+                "django.contrib.auth.context_processors.auth",
+                "django.contrib.messages.context_processors.messages",
+            ]
+        },
+    }
+]
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": os.environ.get("BENCH_DB_NAME", "squarelet_auth_bench"),
+        "USER": os.environ.get("BENCH_DB_USER", ""),
+        "PASSWORD": os.environ.get("BENCH_DB_PASSWORD", ""),
+        "HOST": os.environ.get("BENCH_DB_HOST", ""),
+        "PORT": os.environ.get("BENCH_DB_PORT", ""),
+    }
+}
+DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
+CACHES = {"default": {"BACKEND": "benchapp.cache.LockingLocMemCache"}}
+AUTH_USER_MODEL = "benchapp.User"
+SOCIAL_AUTH_SQUARELET_KEY = "tests"
+SOCIAL_AUTH_SQUARELET_SECRET = "tests"
+SQUARELET_ORGANIZATION_MODEL = "squarelet_auth_organizations.Organization"
+SQUARELET_URL = "http://squarelet.invalid"
+BASE_URL = "http://localhost"
+USE_TZ = True
@@ -0,0 +1,135 @@
+# Django
+from django.db import connection, transaction
+from django.db.models.signals import post_delete
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+# Standard Library
+from uuid import uuid4
+
+# SquareletAuth
+from squarelet_auth.organizations import get_organization_model
+from squarelet_auth.organizations.models import (
+    Membership,
+    memberships_changed,
+    memberships_changed_in_transaction,
+)
+from squarelet_auth.users.utils import squarelet_update_or_create
+
+Organization = get_organization_model()
+
+
+def organization_data(uuid, name, individual=False, admin=False):
+    return {
+        "uuid": str(uuid),
+        "name": name,
+        "slug": name,
+        "entitlements": [],
+        "max_users": 1 if individual else 50,
+        "individual": individual,
+        "private": individual,
+        "card": "",
+        "payment_failed": False,
+        "avatar_url": "",
+        "verified_journalist": False,
+        "admin": admin,
+    }
+
+
+def user_data(uuid, organizations):
+    return {
+        "uuid": str(uuid),
+        "preferred_username": f"user-{uuid}",
+        "email": f"{uuid}@example.com",
+        "name": "Test User",
+        "organizations": [
+            organization_data(uuid, f"individual-{uuid}", individual=True, admin=True)
+        ]
+        + organizations,
+    }
+
+
+class ReconcileMembershipsTest(TestCase):
+    """Syncing a user's organizations takes the same number of queries no
+    matter how many organizations they belong to
+    """
+
+    def sync_queries(self, count):
+        """Sync a user, then count the queries to re-sync them with `count` of
+        their memberships changed
+        """
+        uuid = uuid4()
+        organizations = [
+            organization_data(uuid4(), f"organization-{uuid4()}")
+            for _ in range(count + 1)
+        ]
+        squarelet_update_or_create(uuid, user_data(uuid, organizations))
+
+        # toggle admin on `count` memberships, remove the other one and join a
+        # new organization, which becomes active
+        changed = [dict(o, admin=not o["admin"]) for o in organizations[:-1]]
+        changed.append(organization_data(uuid4(), f"organization-{uuid4()}"))
+        with CaptureQueriesContext(connection) as context:
+            squarelet_update_or_create(uuid, user_data(uuid, changed))
+        return len(context)
+
+    def test_constant_queries(self):
+        self.assertEqual(self.sync_queries(1), self.sync_queries(50))
+
+    def test_removal_sends_signals(self):
+        """Memberships removed by the sync still send the delete signals"""
+        uuid = uuid4()
+        organization = organization_data(uuid4(), f"organization-{uuid4()}")
+        squarelet_update_or_create(uuid, user_data(uuid, [organization]))
+
+        deleted = []
+
+        def receiver(instance, **kwargs):
+            deleted.append(instance.organization_id)
+
+        post_delete.connect(receiver, sender=Membership)
+        try:
+            squarelet_update_or_create(uuid, user_data(uuid, []))
+        finally:
+            post_delete.disconnect(receiver, sender=Membership)
+        self.assertEqual(len(deleted), 1)
+
+    def test_active_organization_follows_memberships(self):
+        """Membership changes made outside of the sync keep the user's active
+        organization pointer up to date
+        """
+        uuid = uuid4()
+        org_uuid = uuid4()
+        organization = organization_data(org_uuid, f"organization-{uuid4()}")
+        user, _ = squarelet_update_or_create(uuid, user_data(uuid, [organization]))
+        active = Organization.objects.get(uuid=org_uuid)
+        self.assertEqual(user.active_organization_id, active.pk)
+
+        Membership.objects.get(user=user, organization=active).delete()
+        user.refresh_from_db()
+        self.assertIsNone(user.active_organization_id)
+
+        individual = Membership.objects.get(user=user, organization__uuid=uuid)
+        individual.active = True
+        individual.save()
+        user.refresh_from_db()
+        self.assertEqual(user.active_organization_id, individual.organization_id)
+
+
+class MembershipsChangedTest(TestCase):
+    """Membership changes are only tracked for the transaction they were made
+    in
+    """
+
+    def test_rollback(self):
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    memberships_changed([1])
+                    self.assertTrue(memberships_changed_in_transaction(1))
+                    raise ValueError
+            except ValueError:
+                pass
+            self.assertFalse(memberships_changed_in_transaction(1))
+            memberships_changed([2])
+            self.assertTrue(memberships_changed_in_transaction(2))
@@ -0,0 +1,22 @@
+# Django
+from django.test import TestCase
+
+# Standard Library
+from uuid import uuid4
+
+# SquareletAuth
+from squarelet_auth.tasks import _pullable_uuids
+from squarelet_auth.users.utils import squarelet_update_or_create
+from tests.test_memberships import user_data
+
+
+class PullableUUIDsTest(TestCase):
+    """Only objects which exist locally are pulled, however their UUIDs are
+    given
+    """
+
+    def test_uuid_formats(self):
+        uuid = uuid4()
+        squarelet_update_or_create(uuid, user_data(uuid, []))
+        uuids = [uuid, str(uuid).upper(), str(uuid4())]
+        self.assertEqual(_pullable_uuids("user", uuids), uuids[:2])